@@ -1,7 +1,6 @@
 import math
 import numpy as np
 import matplotlib.pyplot as plt
-import copy
 from collections import OrderedDict
 from Sides import Sides
 from Env import EnvObjectTypes, ConsumableTypes, Env
@@ -82,6 +81,11 @@ class Animat:
     return self.controller == other.controller and np.array_equal(self.nearest, other.nearest) and np.array_equal(self.dsq, other.dsq) and self.dx == other.dx and self.dy == other.dy and self.dtheta == other.dtheta
 
   def prepare(self, env):
+    readings = self.sense(env)
+    # get chemical outputs
+    self.act(*self.controller.get_outputs(readings))
+
+  def sense(self, env):
     # store closest object of each type
     find_nearest(self, env)
     readings = np.zeros((len(Sides), len(EnvObjectTypes)))
@@ -98,9 +102,9 @@ class Animat:
         reading = get_sens_reading(obj_x, obj_y, sens_x, sens_y, sens_orient)
         readings[side.value][type.value] = reading
         self.sens_hist[side.value][type.value].append(reading)
-    # get chemical outputs
-    left_out, right_out = self.controller.get_outputs(readings)
+    return readings
 
+  def act(self, left_out, right_out):
     # set motor state
     left_motor_state = left_out
     right_motor_state = right_out
@@ -120,13 +124,13 @@ class Animat:
     self.y_hist.append(self.y)
     self.theta += self.dtheta * DT
     # check if encountered any objects
-    encountered = False
     for type in EnvObjectTypes:
       if self.dsq[type.value] <= Animat.RADIUS ** 2:
-        encountered = copy.deepcopy(self.nearest[type.value])
-        env.consumed.append(encountered)
-        self.nearest[type.value].reset()
-        if any(encountered.type == type.name for type in ConsumableTypes):
+        encountered = self.nearest[type.value]
+        env.consumed.append(i, type.value, encountered.x, encountered.y)
+        consumable = any(encountered.type == type.name for type in ConsumableTypes)
+        encountered.reset()
+        if consumable:
           self.battery[type.value] = Animat.FULL_BATTERY
           self.encountered.append({'time': i, 'type': type.value})
         else:
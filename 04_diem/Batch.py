@@ -0,0 +1,114 @@
+import math
+import numpy as np
+from Sides import Sides
+from Env import EnvObjectTypes
+from Network import Network
+from Animat import Animat
+from globals import DT
+
+CONC_MAX = 1000000
+
+
+class BatchedNetworks:
+
+  def __init__(self, networks, n_steps):
+    self.networks = networks
+    n_nets = len(networks)
+    n_chems = max(len(net.chemicals) for net in networks)
+    n_rxns = max(len(net.reactions) for net in networks)
+    width = max([len(rxn.lhs) for net in networks for rxn in net.reactions] + [len(rxn.rhs) for net in networks for rxn in net.reactions] + [1])
+
+    # individual x reaction x slot, padded chemicals hold 1.0 and never change
+    self.lhs_index = np.full((n_nets, n_rxns, width), n_chems)
+    self.rhs_index = np.full((n_nets, n_rxns, width), n_chems)
+    self.forward = np.zeros((n_nets, n_rxns))
+    self.backward = np.zeros((n_nets, n_rxns))
+    self.decay = np.zeros((n_nets, n_chems + 1))
+    self.state = np.ones((n_nets, n_chems + 1))
+    self.entries = []
+
+    for k, net in enumerate(networks):
+      index = {id(chem): i for i, chem in enumerate(net.chemicals)}
+      # (chemical, reaction, sign) triples in the same order as the object walk
+      entries = []
+      for r, rxn in enumerate(net.reactions):
+        for j, chem in enumerate(rxn.lhs):
+          self.lhs_index[k, r, j] = index[id(chem)]
+          entries.append((index[id(chem)], r, -1.0))
+        for j, chem in enumerate(rxn.rhs):
+          self.rhs_index[k, r, j] = index[id(chem)]
+          entries.append((index[id(chem)], r, 1.0))
+        self.forward[k, r] = rxn.forward
+        self.backward[k, r] = rxn.backward
+      for i, chem in enumerate(net.chemicals):
+        self.decay[k, i] = chem.decay
+        self.state[k, i] = chem.conc
+      self.entries.append(np.array(entries).reshape(-1, 3))
+
+    # post-update, pre-input concentrations like Chemical.hist
+    self.hist = np.zeros((n_steps, n_nets, n_chems + 1))
+    self.n_steps = np.zeros(n_nets, dtype=int)
+    self.inputs = [getattr(Network, f'{type.name}_{side.name}') for type in EnvObjectTypes for side in Sides]
+    self.alive = np.ones(n_nets, dtype=bool)
+    self.select()
+
+  def select(self):
+    # flatten the live individuals so one gather and one scatter serve all of them
+    live = np.flatnonzero(self.alive)
+    n_rxns = self.forward.shape[1]
+    n_state = self.state.shape[1]
+    rows = np.arange(len(live))
+    self.live = live
+    self.live_lhs = self.lhs_index[live] + (rows * n_state)[:, None, None]
+    self.live_rhs = self.rhs_index[live] + (rows * n_state)[:, None, None]
+    self.live_forward = self.forward[live]
+    self.live_backward = self.backward[live]
+    self.live_decay = self.decay[live]
+    entries = [self.entries[k] for k in live] + [np.zeros((0, 3))]
+    self.live_entry_chem = np.concatenate([e[:, 0] + j * n_state for j, e in enumerate(entries)]).astype(int)
+    self.live_entry_rxn = np.concatenate([e[:, 1] + j * n_rxns for j, e in enumerate(entries)]).astype(int)
+    self.live_entry_sign = np.concatenate([e[:, 2] for e in entries])
+
+  def kill(self, alive):
+    if np.any(self.alive & ~alive):
+      self.alive &= alive
+      self.select()
+
+  def get_outputs(self, readings):
+    # readings are live individual x side x type
+    state = self.state[self.live]
+    lhs_product = np.multiply.reduce(state.ravel()[self.live_lhs], axis=2)
+    rhs_product = np.multiply.reduce(state.ravel()[self.live_rhs], axis=2)
+    # net rate from lhs to rhs for each reaction
+    flux = lhs_product * self.live_forward - rhs_product * self.live_backward
+
+    dconc = -self.live_decay * state
+    np.add.at(dconc.ravel(), self.live_entry_chem, self.live_entry_sign * flux.ravel()[self.live_entry_rxn])
+    state = np.fmin(np.fmax(state + dconc * DT, 0.0), CONC_MAX)
+    self.hist[self.n_steps[self.live], self.live] = state
+    self.n_steps[self.live] += 1
+
+    # input chemicals are clamped to the sensor readings
+    state[:, self.inputs] = np.transpose(readings, (0, 2, 1)).reshape(len(self.live), -1) * 2
+    self.state[self.live] = state
+    return state[:, Network.OUTPUT_LEFT], state[:, Network.OUTPUT_RIGHT]
+
+  def write_back(self):
+    for k, net in enumerate(self.networks):
+      for i, chem in enumerate(net.chemicals):
+        chem.conc = self.state[k, i]
+        chem.hist.extend(self.hist[:self.n_steps[k], k, i].tolist())
+
+
+def evaluate_batch(animats, envs):
+  n_steps = math.floor(Animat.MAX_LIFE / DT)
+  batch = BatchedNetworks([animat.controller for animat in animats], n_steps)
+  for i in range(n_steps):
+    readings = np.array([animats[k].sense(envs[k]) for k in batch.live])
+    for k, left_out, right_out in zip(batch.live, *batch.get_outputs(readings)):
+      animats[k].act(left_out, right_out)
+      animats[k].update(envs[k], i)
+    batch.kill(np.array([animat.alive for animat in animats]))
+    if not len(batch.live):
+      break
+  batch.write_back()
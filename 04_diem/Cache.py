@@ -0,0 +1,112 @@
+import hashlib
+import pickle
+import sqlite3
+import time
+import zlib
+import numpy as np
+from Animat import Animat
+from Env import Env, EnvObject, EnvObjectTypes, ConsumptionLog
+from globals import DT
+
+
+def sim_config():
+  # everything besides the network and the env seed that changes an evaluation
+  config = (DT, Animat.FULL_BATTERY, Animat.DRAIN_RATE, Animat.MAX_LIFE, Animat.RADIUS, tuple(Animat.SENSOR_ANGLES),
+            tuple(Env.N_OBJECTS), EnvObject.RADIUS, EnvObject.DECAY, EnvObject.CONC_MAX, ConsumptionLog.DTYPE.descr)
+  return hashlib.blake2b(repr(config).encode(), digest_size=8).hexdigest()
+
+
+def record_trajectory(animat, env):
+  return {
+      'x_hist': animat.x_hist,
+      'y_hist': animat.y_hist,
+      'battery_hist': animat.battery_hist,
+      'sens_hist': animat.sens_hist,
+      'motor_hist': animat.motor_hist,
+      'encountered': animat.encountered,
+      'chem_hist': [chem.hist for chem in animat.controller.chemicals],
+      'objects': [[(obj.x, obj.y) for obj in objects] for objects in env.objects],
+      'consumed': env.consumed.records().copy(),
+  }
+
+
+def restore_trajectory(animat, env, trajectory):
+  restore_animat(animat, trajectory)
+  restore_env(env, trajectory)
+
+
+def restore_animat(animat, trajectory):
+  animat.x_hist = trajectory['x_hist']
+  animat.y_hist = trajectory['y_hist']
+  animat.x = animat.x_hist[-1]
+  animat.y = animat.y_hist[-1]
+  animat.battery_hist = trajectory['battery_hist']
+  animat.sens_hist = trajectory['sens_hist']
+  animat.motor_hist = trajectory['motor_hist']
+  animat.encountered = trajectory['encountered']
+  for chem, hist in zip(animat.controller.chemicals, trajectory['chem_hist']):
+    chem.hist = hist
+    chem.conc = hist[-1]
+
+
+def restore_env(env, trajectory):
+  for objects, locs in zip(env.objects, trajectory['objects']):
+    for obj, (x, y) in zip(objects, locs):
+      obj.x, obj.y = x, y
+  env.consumed = ConsumptionLog(trajectory['consumed'])
+
+
+class EvalCache:
+
+  MAX_BYTES = 256 * 1024 * 1024
+
+  def __init__(self, path):
+    self.path = path
+    self.config = sim_config()
+    self.db = sqlite3.connect(path)
+    self.db.execute('CREATE TABLE IF NOT EXISTS evals (key TEXT PRIMARY KEY, fitness REAL, trajectory BLOB, size INTEGER, accessed REAL)')
+
+  def key(self, network, seed):
+    return f'{network.fingerprint()}:{seed}:{self.config}'
+
+  def get(self, key, trajectory=False):
+    # returns (fitness, trajectory), or None when the entry or a requested trajectory is missing
+    row = self.db.execute('SELECT fitness, trajectory FROM evals WHERE key = ?', (key,)).fetchone()
+    if row is None or (trajectory and row[1] is None):
+      return None
+    self.db.execute('UPDATE evals SET accessed = ? WHERE key = ?', (time.time(), key))
+    if trajectory:
+      return row[0], pickle.loads(zlib.decompress(row[1]))
+    return row[0], None
+
+  def put(self, key, fitness, trajectory=None):
+    blob = None if trajectory is None else zlib.compress(pickle.dumps(trajectory))
+    size = len(key) + 16 + (0 if blob is None else len(blob))
+    if blob is None:
+      # keep a stored trajectory when only the fitness is being refreshed
+      row = self.db.execute('SELECT trajectory, size FROM evals WHERE key = ?', (key,)).fetchone()
+      if row is not None and row[0] is not None:
+        blob, size = row
+    self.db.execute('INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?)', (key, float(fitness), blob, size, time.time()))
+
+  def flush(self):
+    # evict least recently used entries until the store fits in MAX_BYTES
+    total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM evals').fetchone()[0]
+    if total > EvalCache.MAX_BYTES:
+      for key, size in self.db.execute('SELECT key, size FROM evals ORDER BY accessed').fetchall():
+        self.db.execute('DELETE FROM evals WHERE key = ?', (key,))
+        total -= size
+        if total <= EvalCache.MAX_BYTES:
+          break
+    self.db.commit()
+
+
+def evaluate_cached(animat, env, seed, cache):
+  key = cache.key(animat.controller, seed)
+  hit = cache.get(key, trajectory=True)
+  if hit is None:
+    animat.evaluate(env)
+    cache.put(key, animat.fitness, record_trajectory(animat, env))
+  else:
+    animat.fitness, trajectory = hit
+    restore_trajectory(animat, env, trajectory)
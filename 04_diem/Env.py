@@ -1,4 +1,3 @@
-import copy
 import numpy as np, matplotlib.pyplot as plt, math
 from enum import Enum
 
@@ -43,6 +42,30 @@ class EnvObject:
     self.x = self.rstate.random() - 0.5
     self.y = self.rstate.random() - 0.5
 
+class ConsumptionLog:
+
+  DTYPE = np.dtype([('step', np.int32), ('type', np.int8), ('x', np.float64), ('y', np.float64)])
+  INITIAL_SIZE = 16
+
+  def __init__(self, records=None):
+    # one (step, type, x, y) record per consumed object, doubled when full
+    records = np.zeros(0, dtype=ConsumptionLog.DTYPE) if records is None else records
+    self.events = np.zeros(max(len(records), ConsumptionLog.INITIAL_SIZE), dtype=ConsumptionLog.DTYPE)
+    self.events[:len(records)] = records
+    self.size = len(records)
+
+  def append(self, step, type, x, y):
+    if self.size == len(self.events):
+      self.events = np.concatenate((self.events, np.zeros(len(self.events), dtype=ConsumptionLog.DTYPE)))
+    self.events[self.size] = (step, type, x, y)
+    self.size += 1
+
+  def records(self):
+    return self.events[:self.size]
+
+  def __len__(self):
+    return self.size
+
 class Env:
 
   MAX_X = 0.5
@@ -54,15 +77,13 @@ class Env:
   def __init__(self, rstate):
     self.rstate = np.random.default_rng(rstate)
     self.objects = [ [ EnvObject(type=str(type.name), rstate=self.rstate) for i in range(Env.N_OBJECTS[type.value]) ] for type in EnvObjectTypes ]
-    self.consumed = []
+    self.consumed = ConsumptionLog()
 
   def update(self, i):
     for type in self.objects:
       for obj in type:
         if obj.conc <= 0:
-          obj_copy = copy.deepcopy(obj)
-          obj_copy.consume_time = i
-          self.consumed.append(obj_copy)
+          self.consumed.append(i, EnvObjectTypes[obj.type].value, obj.x, obj.y)
           obj.reset()
         else:
           obj.conc -= EnvObject.DECAY * DT
@@ -72,8 +93,8 @@ class Env:
     for type in EnvObjectTypes:
       for object in self.objects[type.value]:
         axis.add_patch(plt.Circle((object.x, object.y), EnvObject.RADIUS, color=colors[type.value]))
-    for object in self.consumed:
-      axis.add_patch(plt.Circle((object.x, object.y), EnvObject.RADIUS, color=colors[EnvObjectTypes[object.type].value], fill=False))
+    for event in self.consumed.records():
+      axis.add_patch(plt.Circle((event['x'], event['y']), EnvObject.RADIUS, color=colors[event['type']], fill=False))
       
 
 if __name__ == '__main__':
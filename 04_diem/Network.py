@@ -2,6 +2,7 @@ from functools import reduce
 from Sides import Sides
 from collections import Counter
 import copy
+import hashlib
 import numpy as np
 from Env import EnvObjectTypes
 from globals import DT, AGGREGATION, MUTATION_RATE
@@ -174,6 +175,19 @@ class Network:
   def __str__(self):
     return ' '.join([repr(chemical) for chemical in self.chemicals]) + '\n' + '\n'.join([repr(reaction) for reaction in self.reactions])
 
+  def fingerprint(self):
+    # hash of everything that defines the network, independent of its current state
+    index = {id(chem): i for i, chem in enumerate(self.chemicals)}
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.array([len(self.chemicals), len(self.reactions)]).tobytes())
+    for chem in self.chemicals:
+      digest.update(f'{chem.formula}|'.encode())
+      digest.update(np.array([chem.potential, chem.initial_conc, chem.decay], dtype=float).tobytes())
+    for rxn in self.reactions:
+      digest.update(np.array([len(rxn.lhs), len(rxn.rhs)] + [index[id(chem)] for chem in rxn.lhs] + [index[id(chem)] for chem in rxn.rhs]).tobytes())
+      digest.update(np.array([rxn.fav_rate, rxn.forward, rxn.backward], dtype=float).tobytes())
+    return digest.hexdigest()
+
   def new_reaction(self):
 
     def decompose(formula):
@@ -1,6 +1,8 @@
 import numpy as np
 from Animat import Animat
 from Env import Env
+from Batch import evaluate_batch
+from Cache import record_trajectory, restore_animat
 
 POP_RNG = np.random.default_rng(123456789)
 
@@ -10,17 +12,62 @@ class Population:
   DEME_SIZE = 10
   MUT = 0.04
   N_TOUR_ROUNDS = 10
+  STATS_INTERVAL = 10
 
-  def __init__(self):
+  def __init__(self, lazy=False):
     self.animats = [Animat() for _ in range(Population.SIZE)]
+    # when lazy, individuals are only simulated once drawn into a tournament
+    self.lazy = lazy
+    self.seed = None
+    self.batched = True
+    self.generation = 0
+    self.evaluated = set()
+    self.pairs = None
 
-  def eval(self, generation):
-    fitnesses = [None] * Population.SIZE
-    for i, animat in enumerate(self.animats):
-      env = Env(generation)
-      animat.evaluate(env)
+  def evaluate(self, indices, generation, batched=True, cache=None, trajectories=False, simulate=True):
+    # with a cache, only networks never evaluated on this seed are simulated
+    if generation != self.seed:
+      self.seed = generation
+      self.evaluated = set()
+    pending = []
+    for i in indices:
+      animat = self.animats[i]
+      key = None if cache is None else cache.key(animat.controller, generation)
+      hit = None if cache is None else cache.get(key, trajectories)
+      if hit is None:
+        pending.append((i, Env(generation), key))
+      else:
+        animat.fitness, trajectory = hit
+        # only the animat's histories, nobody keeps the env to plot
+        if trajectories:
+          restore_animat(animat, trajectory)
+        self.evaluated.add(i)
+    if not simulate:
+      return
+
+    if batched and len(pending):
+      evaluate_batch([self.animats[i] for i, _, _ in pending], [env for _, env, _ in pending])
+    else:
+      for i, env, _ in pending:
+        self.animats[i].evaluate(env)
+    if cache is not None:
+      for i, env, key in pending:
+        cache.put(key, self.animats[i].fitness, record_trajectory(self.animats[i], env) if trajectories else None)
+      cache.flush()
+    self.evaluated.update(i for i, _, _ in pending)
 
-      fitnesses[i] = animat.fitness
+  def eval(self, generation, batched=True, cache=None, trajectories=False):
+    self.batched = batched
+    everyone = range(Population.SIZE)
+    if self.lazy and not trajectories and self.generation % Population.STATS_INTERVAL:
+      # statistics from the coming tournaments and cached fitnesses, everyone is simulated every STATS_INTERVAL generations
+      if cache is not None:
+        self.evaluate(everyone, generation, cache=cache, simulate=False)
+      self.evaluate(self.participants(), generation, batched, cache)
+    else:
+      self.evaluate(everyone, generation, batched, cache, trajectories)
+    indices = sorted(self.evaluated)
+    fitnesses = [self.animats[i].fitness for i in indices]
 
     best_index = np.argmax(fitnesses)
     max = fitnesses[best_index]
@@ -28,15 +75,31 @@ class Population:
     min = np.amin(fitnesses)
     print('max:', round(max, 3), 'mean:',
           round(mean, 3), 'min:', round(min, 3))
-    return max, mean, min, self.animats[best_index]
+    return max, mean, min, self.animats[indices[best_index]]
 
-  def evolve(self):
-    controllers = [animat.controller.deep_copy() for animat in self.animats]
-    for _ in range(Population.N_TOUR_ROUNDS):
-      a = POP_RNG.integers(Population.SIZE)
-      b = (a + 1 + POP_RNG.integers(Population.DEME_SIZE)
-           ) % Population.SIZE  # wrap around
+  def draw_pairs(self):
+    # the pairs do not depend on fitness, so all are drawn before anyone is simulated
+    if self.pairs is None:
+      self.pairs = []
+      for _ in range(Population.N_TOUR_ROUNDS):
+        a = POP_RNG.integers(Population.SIZE)
+        b = (a + 1 + POP_RNG.integers(Population.DEME_SIZE)
+             ) % Population.SIZE  # wrap around
+        self.pairs.append((a, b))
+    return self.pairs
 
+  def participants(self):
+    return sorted({i for pair in self.draw_pairs() for i in pair} - self.evaluated)
+
+  def evolve(self, cache=None):
+    # the cache is passed in rather than kept, so the population can still be pickled
+    if self.lazy:
+      self.evaluate(self.participants(), self.seed, self.batched, cache)
+    pairs = self.draw_pairs()
+    self.pairs = None
+
+    controllers = [animat.controller.deep_copy() for animat in self.animats]
+    for a, b in pairs:
       if (self.animats[a].fitness > self.animats[b].fitness):
         controllers[b] = controllers[a].deep_copy()
         controllers[b].mutate()
@@ -45,3 +108,5 @@ class Population:
         controllers[a].mutate()
 
     self.animats = [Animat(controller) for controller in controllers]
+    self.evaluated = set()
+    self.generation += 1
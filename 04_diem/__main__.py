@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 import pickle
 from Env import Env
 from Population import Population
+from Cache import EvalCache
 from Animat import test_animat_trial
 from globals import TOTAL_RUNS
 
@@ -13,6 +14,7 @@ if __name__ == '__main__':
 
   highest_fitness = 0
   pop = Population()
+  cache = EvalCache('./saved_vars/eval_cache.sqlite')
   mean = [None] * BATCHES * BATCH_SIZE
   max = [None] * BATCHES * BATCH_SIZE
   min = [None] * BATCHES * BATCH_SIZE
@@ -22,16 +24,16 @@ if __name__ == '__main__':
     for repeat in range(BATCH_SIZE):
       gen = batch * BATCH_SIZE + repeat
       print(gen)
-      max[gen], mean[gen], min[gen], best = pop.eval(batch + TRIAL)
+      max[gen], mean[gen], min[gen], best = pop.eval(batch + TRIAL, cache=cache)
       if best.fitness > highest_fitness:
         champ_controller = best.controller.deep_copy()
         highest_fitness = best.fitness
         plt.close('all')
         # test_animat_trial(env=Env(batch + TRIAL), controller=best.controller.deep_copy(
         # ), show=False, save=True, fname=batch)
-      pop.evolve()
+      pop.evolve(cache=cache)
 
-    pop.eval(batch + TRIAL)
+    pop.eval(batch + TRIAL, cache=cache, trajectories=True)
     with open(f'./saved_vars/trial_{TRIAL}/pop_{BATCH_SIZE}_batch_{batch}.pkl', 'wb') as f:
       pickle.dump([pop, champ_controller], f)
 
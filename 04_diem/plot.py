@@ -6,6 +6,7 @@ import seaborn as sns
 import pickle
 from Animat import Animat
 from Env import Env, EnvObject, EnvObjectTypes, ConsumableTypes
+from Cache import EvalCache, evaluate_cached
 from Sides import Sides
 from globals import DT, TOTAL_RUNS
 
@@ -69,9 +70,9 @@ def create_cartesian_plot(ax, animat, title, is_population=True, env=None):
       for object in env.objects[type.value]:
         ax.add_patch(plt.Circle((object.x, object.y),
                      EnvObject.RADIUS, color=colors[type.value]))
-    for object in env.consumed:
-      ax.add_patch(plt.Circle((object.x, object.y), EnvObject.RADIUS,
-                   color=colors[EnvObjectTypes[object.type].value], fill=False))
+    for event in env.consumed.records():
+      ax.add_patch(plt.Circle((event['x'], event['y']), EnvObject.RADIUS,
+                   color=colors[event['type']], fill=False))
 
 
 def plot_population_fitnesses(batch_size, max, mean, min):
@@ -277,12 +278,14 @@ if __name__ == '__main__':
 
   champ_animats = []
   envs = []
+  cache = EvalCache('./saved_vars/eval_cache.sqlite')
   for batch, controller in enumerate(champ_controllers):
     env = Env(batch + TRIAL)
     animat = Animat(controller)
-    animat.evaluate(env)
+    evaluate_cached(animat, env, batch + TRIAL, cache)
     champ_animats.append(animat)
     envs.append(env)
+  cache.flush()
 
   # plot_life(BATCH_SIZE, champ_animats, envs)
   # plot_battery(BATCH_SIZE, champ_animats)
@@ -1,46 +1,34 @@
-import math, numpy as np, matplotlib.pyplot as plt, copy
+import math, numpy as np, matplotlib.pyplot as plt
 from collections import OrderedDict
 from Sides import Sides
 from Mapping import Mapping
 from Env import EnvObjectTypes, ConsumableTypes, Env
 from Network import Network
+from Sensors import get_sens_readings
 from graphviz import Digraph
-from globals import DT
+from Recording import Recording
+from globals import DT, RECORD_INTERVAL
 
 np.seterr(all='raise')
 
-def find_nearest(animat, env):
+def find_nearest(animat, env, x=None, y=None):
+  # position defaults to the animat's own
+  x = animat.x if x is None else x
+  y = animat.y if y is None else y
   for type in EnvObjectTypes:
-    min_dsq = math.inf
-    for object in env.objects[type]:
-      dsq = (animat.x - object.x)**2 + (animat.y - object.y)**2
-      if (dsq < min_dsq):
-        min_dsq = dsq
-        animat.dsq[type] = dsq
-        animat.nearest[type] = object
+    animat.nearest[type], animat.dsq[type] = env.find_nearest(type, x, y)
 
-def get_sens_reading(obj_x, obj_y, sens_x, sens_y, sens_orient):
+def fitness_bound(fitness, battery_agg, refill, n_steps):
+  # batteries only drain between encounters and each step refills each battery at most once,
+  # so the battery total n steps ahead is at most battery_agg + n * refill
+  return fitness + (n_steps * battery_agg + refill * n_steps * (n_steps + 1) / 2) * DT * 10
 
-  # larger falloff means farther sight
-  falloff = 0.25
-
-  d_sq = (sens_x - obj_x)**2 + (sens_y - obj_y)**2
-
-  omni = falloff/(falloff + d_sq) # (0,1)
-  
-  # sensor to object vector
-  s2o = [obj_x - sens_x, 
-        obj_y - sens_y]
-  s2o_mag = np.sqrt(d_sq)
-  # normalise
-  if s2o_mag > 0:
-    s2o = [v / s2o_mag for v in s2o]
-  # sensor direction unit vector
-  sens_uv = [math.cos(sens_orient),
-              math.sin(sens_orient)]
-
-  # positive component of sensor to object projection on sensor direction
-  return omni * max(0.0, s2o[0]*sens_uv[0] + s2o[1]*sens_uv[1])
+def battery_refill(chemistry):
+  # most a step of encounters can add to the batteries, unbounded if reactions touch them
+  batteries = [type.value for type in ConsumableTypes]
+  if np.any(chemistry.lhs_stoich[:, batteries]) or np.any(chemistry.rhs_stoich[:, batteries]):
+    return math.inf
+  return np.sum(chemistry.initial_conc[batteries])
 
 class Animat:
 
@@ -48,15 +36,15 @@ class Animat:
   RADIUS = 0.05
   SENSOR_ANGLES = [math.pi/4, -math.pi/4]
 
-  def __init__(self, controller=None):
-    if controller is None:
+  def __init__(self, controller=None, chemistry=None):
+    # a bare compiled network is enough to simulate, e.g. in a worker process
+    if controller is None and chemistry is None:
       self.controller = Network()
     else:
       self.controller = controller
+    self.chemistry = self.controller.compile() if chemistry is None else chemistry
     self.nearest = [None for _ in EnvObjectTypes]
     self.dsq = [None for _ in EnvObjectTypes]
-    self.motor_hist = [[] for _ in Sides]
-    self.sens_hist = [[[] for _ in ConsumableTypes] for _ in Sides]
     self.encountered = []
     self.dx = None
     self.dy = None
@@ -68,10 +56,15 @@ class Animat:
     self.x = Env.MAX_X
     self.y = Env.MIN_Y
     self.theta = math.pi * 5 / 8
-    self.x_hist = [self.x]
-    self.y_hist = [self.y]
+    self.allocate_hist(Recording.NONE)
 
     self.fitness = 0
+    # spread of the fitness over env seeds, when evaluated on several
+    self.fitnesses = []
+    self.fitness_var = 0
+    # steps simulated, and fitness at each horizon when raced with successive halving
+    self.fidelity = math.floor(Animat.MAX_LIFE / DT)
+    self.rung_fitness = {}
     self.alive = True
 
 
@@ -80,25 +73,24 @@ class Animat:
 
 
   def prepare(self, env):
+    readings = self.sense(env)
+    # get chemical outputs
+    self.act(self.chemistry.get_outputs(readings))
+
+
+  def sense(self, env):
     # store closest object of each type
     find_nearest(self, env)
-    readings = np.zeros((len(Sides), len(EnvObjectTypes)))
     # sensor readings
-    for side in Sides:
-      # sensor properties
-      sens_orient = self.theta + self.SENSOR_ANGLES[side]
-      sens_x = self.x + self.RADIUS * math.cos(sens_orient)
-      sens_y = self.y + self.RADIUS * math.sin(sens_orient)
-      # calculate reading for each sensor
-      for type in EnvObjectTypes:
-        obj_x = self.nearest[type].x
-        obj_y = self.nearest[type].y
-        reading = get_sens_reading(obj_x, obj_y, sens_x, sens_y, sens_orient)
-        readings[side][type] = reading
-        self.sens_hist[side][type].append(reading)
-    # get chemical outputs
-    mapping_chemicals = self.controller.get_outputs(readings)
-    
+    obj_x = np.array([[self.nearest[type].x for type in EnvObjectTypes]])
+    obj_y = np.array([[self.nearest[type].y for type in EnvObjectTypes]])
+    readings = get_sens_readings(np.array([self.x]), np.array([self.y]), np.array([self.theta]), obj_x, obj_y, Animat.RADIUS, Animat.SENSOR_ANGLES)[0]
+    if self.record_index >= 0:
+      self.sens_hist[:, :, self.record_index] = readings
+    return readings
+
+
+  def act(self, mapping_chemicals):
     if (mapping_chemicals[Mapping.OUTPUT_LEFT] > 10 or mapping_chemicals[Mapping.OUTPUT_RIGHT] > 10):
       print('hello')
       # test_animat_trial(env=Env(0), controller=self.controller.deep_copy())
@@ -106,8 +98,11 @@ class Animat:
     # set motor state
     left_motor_state = mapping_chemicals[Mapping.OUTPUT_LEFT]
     right_motor_state = mapping_chemicals[Mapping.OUTPUT_RIGHT]
-    self.motor_hist[Sides.LEFT].append(left_motor_state)
-    self.motor_hist[Sides.RIGHT].append(right_motor_state)
+    if self.record_index >= 0:
+      self.motor_hist[Sides.LEFT, self.record_index] = left_motor_state
+      self.motor_hist[Sides.RIGHT, self.record_index] = right_motor_state
+      # chemistry has just been stepped, before any consumption
+      self.chem_hist[self.record_index + 1] = self.chemistry.conc
     # calculate derivs
     mag = (left_motor_state + right_motor_state) / 2
     self.dx = mag * math.cos(self.theta)
@@ -118,43 +113,90 @@ class Animat:
   def update(self, env, i):
     # update position and orientation
     self.x += self.dx * DT
-    self.x_hist.append(self.x)
     self.y += self.dy * DT
-    self.y_hist.append(self.y)
+    if self.record_index >= 0:
+      self.x_hist[self.record_index + 1] = self.x
+      self.y_hist[self.record_index + 1] = self.y
+      self.n_records += 1
     self.theta += self.dtheta * DT
     while self.theta > 2*math.pi:
       self.theta -= 2*math.pi
     while self.theta < 0:
       self.theta += 2*math.pi
 
-    # check if encountered any objects
-    encountered = False
-    for type in EnvObjectTypes:
-      if self.dsq[type] <= 2 * (Animat.RADIUS ** 2):
-        encountered = copy.deepcopy(self.nearest[type])
-        env.consumed.append(encountered)
-        self.nearest[type].reset()
-        if any(encountered.type == type.name for type in ConsumableTypes):
-          self.controller.chemicals[type].conc += self.controller.chemicals[type].initial_conc
-          self.encountered.append({'time': i, 'type': type})
-        else:
-          self.alive = False
+    self.consume(env, i)
 
     # update battery and env
     # TODO change to product
-    battery_agg = np.sum([self.controller.chemicals[type].conc for type in ConsumableTypes])
-    # battery_agg = np.prod([self.controller.chemicals[type].conc for type in ConsumableTypes])
+    battery_agg = np.sum([self.chemistry.conc[type] for type in ConsumableTypes])
+    # battery_agg = np.prod([self.chemistry.conc[type] for type in ConsumableTypes])
     self.fitness += battery_agg * DT * 10
     if battery_agg <= 0:
       self.alive = False
 
 
-  def evaluate(self, env):
-    for i in range(math.floor(Animat.MAX_LIFE / DT)):
+  def consume(self, env, i):
+    # check if encountered any objects
+    for type in EnvObjectTypes:
+      if self.dsq[type] <= 2 * (Animat.RADIUS ** 2):
+        encountered = self.nearest[type]
+        env.consumed.append(i, type, encountered.x, encountered.y)
+        consumable = any(encountered.type == type.name for type in ConsumableTypes)
+        encountered.reset()
+        if consumable:
+          self.chemistry.conc[type] += self.chemistry.initial_conc[type]
+          self.encountered.append({'time': i, 'type': type})
+        else:
+          self.alive = False
+
+
+  def allocate_hist(self, recording):
+    # record nothing, every RECORD_INTERVAL-th step, or every step
+    self.interval = [0, RECORD_INTERVAL, 1][recording]
+    n_records = math.ceil(math.floor(Animat.MAX_LIFE / DT) / self.interval) if self.interval else 0
+    self.n_records = 0
+    self.record_index = -1
+    self.x_hist = np.zeros(n_records + 1)
+    self.y_hist = np.zeros(n_records + 1)
+    self.x_hist[0] = self.x
+    self.y_hist[0] = self.y
+    self.sens_hist = np.zeros((len(Sides), len(EnvObjectTypes), n_records))
+    self.motor_hist = np.zeros((len(Sides), n_records))
+    self.chem_hist = np.zeros((n_records + 1, len(self.chemistry.conc)))
+    self.chem_hist[0] = self.chemistry.conc
+
+  def start_step(self, i):
+    self.record_index = self.n_records if self.interval and i % self.interval == 0 else -1
+
+  def trim_hist(self):
+    self.x_hist = self.x_hist[:self.n_records + 1]
+    self.y_hist = self.y_hist[:self.n_records + 1]
+    self.sens_hist = self.sens_hist[:, :, :self.n_records]
+    self.motor_hist = self.motor_hist[:, :self.n_records]
+    self.chem_hist = self.chem_hist[:self.n_records + 1]
+
+  def evaluate(self, env, recording=Recording.NONE, must_beat=None):
+    # with must_beat, stop once the fitness surely ends up above or below it
+    self.allocate_hist(recording)
+    # without a recording, only the part of the network that can reach the outputs or batteries is simulated
+    full = self.chemistry
+    if recording == Recording.NONE:
+      self.chemistry = full.pruned()
+    n_steps = math.floor(Animat.MAX_LIFE / DT)
+    refill = battery_refill(self.chemistry) if must_beat is not None else None
+    for i in range(n_steps):
+      self.start_step(i)
       self.prepare(env)
       self.update(env, i)
       if not self.alive:
         break
+      if must_beat is not None:
+        battery_agg = np.sum([self.chemistry.conc[type] for type in ConsumableTypes])
+        if self.fitness > must_beat or fitness_bound(self.fitness, battery_agg, refill, n_steps - i - 1) < must_beat:
+          self.fidelity = i + 1
+          break
+    self.chemistry = full.unpruned(self.chemistry)
+    self.trim_hist()
 
   def graph(self):
     dot = Digraph(comment='chem', engine='neato')
@@ -184,7 +226,7 @@ def test_animat_trial(env, controller=None, show=True, save=False, fname=''):
     animat = Animat()
   else:
     animat = Animat(controller)
-  animat.evaluate(env)
+  animat.evaluate(env, Recording.FULL)
 
   type_colors = ['g', 'b', 'r']
   sens_motor_subs = plt.figure(constrained_layout=True, figsize=(9,6)).subplots(2, 1)
@@ -206,10 +248,11 @@ def test_animat_trial(env, controller=None, show=True, save=False, fname=''):
   chem = plt.figure(constrained_layout=True, figsize=(12,6)).subplots(2, 1)
   chem[0].set_title('Chemical concentrations')
   chem[1].set_title('Energy')
-  total_chem = np.zeros(len(animat.controller.chemicals[0].hist))
-  total_energy = np.zeros(len(animat.controller.chemicals[0].hist))
+  chem_hist = animat.chem_hist
+  total_chem = np.zeros(len(chem_hist))
+  total_energy = np.zeros(len(chem_hist))
   for (i, chemical) in enumerate(animat.controller.chemicals):
-    hist = chemical.hist
+    hist = chem_hist[:, i]
     if i != Mapping.WATER_BATTERY and i != Mapping.FOOD_BATTERY:
       energy = np.array(hist) * chemical.potential
     else:
@@ -286,7 +329,7 @@ if __name__ == '__main__':
   # fig, ax = plt.subplots()
   # for i, x in enumerate(xs):
   #   for j, y in enumerate(ys):
-  #     values[i][j] = get_sens_reading(x, y, X, Y, theta)
+  #     values[i][j] = get_sens_readings(np.array([X]), np.array([Y]), np.array([theta]), np.array([[x]]), np.array([[y]]), 0, [0])[0, 0, 0]
   # # ax.arrow(X, Y, math.cos(theta), math.sin(theta), color='red', head_width=1, head_length=1)
   # im = ax.imshow(values)
   # ax.invert_yaxis()
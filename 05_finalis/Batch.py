@@ -0,0 +1,186 @@
+import math
+import numpy as np
+from Sides import Sides
+from Mapping import Mapping
+from Env import EnvObjectTypes
+from Animat import Animat, find_nearest, fitness_bound, battery_refill
+from Compiled import CompiledNetwork, EULER_INTEGRATORS
+from Sensors import get_sens_readings
+from Recording import Recording
+from Kinematics import Kinematics
+from globals import DT
+
+
+class BatchedNetworks:
+
+  def __init__(self, networks):
+    self.networks = networks
+    n_nets = len(networks)
+    n_chems = max(len(net.conc) for net in networks)
+    n_rxns = max(len(net.forward) for net in networks)
+    width = max(net.lhs_index.shape[1] for net in networks)
+
+    # individual x reaction x slot, padded chemicals hold 1.0 and never change
+    self.lhs_index = np.full((n_nets, n_rxns, width), n_chems)
+    self.rhs_index = np.full((n_nets, n_rxns, width), n_chems)
+    self.forward = np.zeros((n_nets, n_rxns))
+    self.backward = np.zeros((n_nets, n_rxns))
+    self.influence = np.zeros((n_nets, n_rxns), dtype=int)
+    self.decay = np.zeros((n_nets, n_chems + 1))
+    self.drain = np.zeros((n_nets, n_chems + 1))
+    self.state = np.ones((n_nets, n_chems + 1))
+    self.entries = []
+
+    for k, net in enumerate(networks):
+      rxns, chems = len(net.forward), len(net.conc)
+      self.lhs_index[k, :rxns, :net.lhs_index.shape[1]] = np.where(net.lhs_index == chems, n_chems, net.lhs_index)
+      self.rhs_index[k, :rxns, :net.rhs_index.shape[1]] = np.where(net.rhs_index == chems, n_chems, net.rhs_index)
+      self.forward[k, :rxns] = net.forward
+      self.backward[k, :rxns] = net.backward
+      self.influence[k, :rxns] = net.influence
+      self.decay[k, :chems] = net.decay
+      self.drain[k, :chems] = net.drain
+      self.entries.append((net.entry_chem, net.entry_rxn, net.entry_sign))
+      # the compiled network keeps reading and writing its row of the batch
+      net.bind(self.state[k])
+
+    self.alive = np.ones(n_nets, dtype=bool)
+    self.select()
+
+  def select(self):
+    # flatten the live individuals so one gather and one scatter serve all of them
+    live = np.flatnonzero(self.alive)
+    n_rxns = self.forward.shape[1]
+    n_state = self.state.shape[1]
+    rows = np.arange(len(live))
+    self.live = live
+    self.live_lhs = self.lhs_index[live] + (rows * n_state)[:, None, None]
+    self.live_rhs = self.rhs_index[live] + (rows * n_state)[:, None, None]
+    self.live_influence = self.influence[live] + (rows * len(Sides) * len(EnvObjectTypes))[:, None]
+    self.live_forward = self.forward[live]
+    self.live_backward = self.backward[live]
+    self.live_decay = self.decay[live]
+    self.live_drain = self.drain[live]
+    self.live_entry_chem = np.concatenate([self.entries[k][0] + j * n_state for j, k in enumerate(live)] + [np.zeros(0, dtype=int)])
+    self.live_entry_rxn = np.concatenate([self.entries[k][1] + j * n_rxns for j, k in enumerate(live)] + [np.zeros(0, dtype=int)])
+    self.live_entry_sign = np.concatenate([self.entries[k][2] for k in live] + [np.zeros(0)])
+
+  def kill(self, alive):
+    if np.any(self.alive & ~alive):
+      self.alive &= alive
+      self.select()
+
+  def get_outputs(self, readings):
+    # readings are live individual x side x type
+    if CompiledNetwork.INTEGRATOR not in EULER_INTEGRATORS:
+      # each network solves on its own row of the batch
+      for j, k in enumerate(self.live):
+        self.networks[k].get_outputs(readings[j])
+      return self.state[self.live, :len(Mapping)]
+    state = self.state[self.live]
+    influence = np.exp(np.ravel(readings)[self.live_influence])
+    lhs_product = np.multiply.reduce(state.ravel()[self.live_lhs], axis=2)
+    rhs_product = np.multiply.reduce(state.ravel()[self.live_rhs], axis=2)
+    # net rate from lhs to rhs for each reaction
+    flux = lhs_product * self.live_forward * influence - rhs_product * self.live_backward * influence
+
+    dconc = self.live_drain - self.live_decay * state
+    np.add.at(dconc.ravel(), self.live_entry_chem, self.live_entry_sign * flux.ravel()[self.live_entry_rxn])
+    self.state[self.live] = np.fmax(state + dconc * DT, 0.0)
+
+    # return chemicals of interest
+    return self.state[self.live, :len(Mapping)]
+
+
+class BatchedTrial:
+
+  def __init__(self, animats, envs, recording=Recording.NONE, must_beat=None):
+    self.animats = animats
+    self.envs = envs
+    for animat in animats:
+      animat.allocate_hist(recording)
+    # without a recording, only the part of each network that can reach the outputs or batteries is simulated
+    self.full = [animat.chemistry for animat in animats]
+    if recording == Recording.NONE:
+      for animat in animats:
+        animat.chemistry = animat.chemistry.pruned()
+    self.batch = BatchedNetworks([animat.chemistry for animat in animats])
+    self.kinematics = Kinematics(animats)
+    self.n_steps = math.floor(Animat.MAX_LIFE / DT)
+    self.step = 0
+    # stopped individuals are left where they are, unlike dead ones
+    self.running = np.ones(len(animats), dtype=bool)
+    self.fidelity = np.full(len(animats), self.n_steps)
+    # nan where there is nothing to beat
+    self.must_beat = None if must_beat is None else np.asarray(must_beat, dtype=float)
+    if self.must_beat is not None:
+      self.refill = np.array([battery_refill(animat.chemistry) for animat in animats])
+
+  def stop(self, running):
+    self.fidelity[self.running & ~running] = self.step
+    self.running &= running
+    self.batch.kill(self.kinematics.alive & self.running)
+
+  def run(self, horizon):
+    # simulate until step horizon, can be resumed later
+    animats, envs, batch, kinematics = self.animats, self.envs, self.batch, self.kinematics
+    for i in range(self.step, min(horizon, self.n_steps)):
+      self.step = i + 1
+      live = batch.live
+      if not len(live):
+        break
+      for k in live:
+        animat = animats[k]
+        animat.start_step(i)
+        find_nearest(animat, envs[k], kinematics.x[k], kinematics.y[k])
+      obj_x = np.array([[animats[k].nearest[type].x for type in EnvObjectTypes] for k in live])
+      obj_y = np.array([[animats[k].nearest[type].y for type in EnvObjectTypes] for k in live])
+      readings = get_sens_readings(kinematics.x[live], kinematics.y[live], kinematics.theta[live], obj_x, obj_y, Animat.RADIUS, Animat.SENSOR_ANGLES)
+      mapping_chemicals = batch.get_outputs(readings)
+      kinematics.act(live, mapping_chemicals[:, Mapping.OUTPUT_LEFT], mapping_chemicals[:, Mapping.OUTPUT_RIGHT])
+      kinematics.move(live)
+      record_index = animats[live[0]].record_index
+      if record_index >= 0:
+        for j, k in enumerate(live):
+          animat = animats[k]
+          animat.sens_hist[:, :, record_index] = readings[j]
+          animat.motor_hist[Sides.LEFT, record_index] = mapping_chemicals[j, Mapping.OUTPUT_LEFT]
+          animat.motor_hist[Sides.RIGHT, record_index] = mapping_chemicals[j, Mapping.OUTPUT_RIGHT]
+          animat.chem_hist[record_index + 1] = animat.chemistry.conc
+          animat.x_hist[record_index + 1] = kinematics.x[k]
+          animat.y_hist[record_index + 1] = kinematics.y[k]
+          animat.n_records += 1
+
+      # objects are only consumed by the few animats touching one
+      dsq = np.array([animats[k].dsq for k in live])
+      for k in live[np.any(dsq <= 2 * (Animat.RADIUS ** 2), axis=1)]:
+        animats[k].consume(envs[k], i)
+        kinematics.alive[k] &= animats[k].alive
+
+      battery_agg = batch.state[live, Mapping.FOOD_BATTERY] + batch.state[live, Mapping.WATER_BATTERY]
+      kinematics.accumulate(live, battery_agg)
+      if self.must_beat is not None:
+        # stop once the fitness surely ends up above or below the threshold
+        fitness, must_beat = kinematics.fitness[live], self.must_beat[live]
+        bound = fitness_bound(fitness, battery_agg, self.refill[live], self.n_steps - i - 1)
+        settled = kinematics.alive[live] & ((fitness > must_beat) | (bound < must_beat))
+        if np.any(settled):
+          running = np.ones(len(animats), dtype=bool)
+          running[live[settled]] = False
+          self.stop(running)
+      batch.kill(kinematics.alive & self.running)
+
+  def finish(self):
+    self.kinematics.write_back(self.animats)
+    for animat, chemistry in zip(self.animats, self.full):
+      animat.chemistry = chemistry.unpruned(animat.chemistry)
+    for animat, fidelity in zip(self.animats, self.fidelity):
+      # the dead are complete, their fitness will not change
+      animat.fidelity = fidelity if animat.alive else self.n_steps
+      animat.trim_hist()
+
+
+def evaluate_batch(animats, envs, recording=Recording.NONE, must_beat=None):
+  trial = BatchedTrial(animats, envs, recording, must_beat)
+  trial.run(trial.n_steps)
+  trial.finish()
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+from Animat import Animat
+from Compiled import CompiledNetwork
+from Env import Env, EnvObject
+from globals import DT, DRAIN_RATE
+
+
+def sim_config():
+  # everything besides the network and the env seed that changes a fitness
+  return (DT, DRAIN_RATE, Animat.MAX_LIFE, Animat.RADIUS, tuple(Animat.SENSOR_ANGLES), tuple(Env.N_OBJECTS), EnvObject.RADIUS,
+          CompiledNetwork.INTEGRATOR, CompiledNetwork.NEWTON_ITERS, CompiledNetwork.NEWTON_TOL)
+
+
+class FitnessCache:
+
+  MAX_SIZE = 10000
+
+  def __init__(self):
+    self.fitnesses = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def key(self, network, seed):
+    # the config is read on every lookup, so switching e.g. the integrator on a live population misses
+    return (network.fingerprint(), seed, sim_config())
+
+  def get(self, key):
+    # (fitness, partial fitness by horizon) of a complete run
+    if key in self.fitnesses:
+      self.hits += 1
+      self.fitnesses.move_to_end(key)
+      return self.fitnesses[key]
+    self.misses += 1
+    return None
+
+  def put(self, key, fitness, rung_fitness=None):
+    self.fitnesses[key] = (fitness, dict(rung_fitness or {}))
+    self.fitnesses.move_to_end(key)
+    while len(self.fitnesses) > FitnessCache.MAX_SIZE:
+      self.fitnesses.popitem(last=False)
@@ -0,0 +1,58 @@
+from collections import OrderedDict
+import math
+from globals import DT
+
+MAX_GENERATED = 1024
+GENERATED = OrderedDict()
+
+
+def literal(value):
+  # repr round-trips floats exactly, nan and inf are names in the namespace
+  return repr(float(value))
+
+
+def generate_source(compiled):
+  # one explicit step, in the same operation order as CompiledNetwork.get_derivs so results match bit for bit
+  n_chems = len(compiled.decay)
+  lines = ['def step(c, e):']
+  names = [f'c{i}' for i in range(n_chems)]
+  if n_chems:
+    lines.append(f'  {", ".join(names)}, = c')
+  for r in range(len(compiled.forward)):
+    lhs = '*'.join(names[i] for i in compiled.lhs_index[r] if i < n_chems) or '1.0'
+    rhs = '*'.join(names[i] for i in compiled.rhs_index[r] if i < n_chems) or '1.0'
+    influence = f'e[{compiled.influence[r]}]'
+    lines.append(f'  f{r} = {lhs}*{literal(compiled.forward[r])}*{influence} - {rhs}*{literal(compiled.backward[r])}*{influence}')
+  for i in range(n_chems):
+    lines.append(f'  d{i} = {literal(compiled.drain[i])} - {literal(compiled.decay[i])}*c{i}')
+  for chem, r, sign in zip(compiled.entry_chem, compiled.entry_rxn, compiled.entry_sign):
+    lines.append(f'  d{chem} = d{chem} {"+" if sign > 0 else "-"} f{r}')
+  for i in range(n_chems):
+    lines.append(f'  c{i} = c{i} + d{i}*{literal(DT)}')
+  # python floats overflow to inf and nan without a word, where numpy raises under np.seterr(all='raise'),
+  # except for chemicals of reactions between batteries, whose nan rates numpy passes through as well
+  unfavoured = {r for r in range(len(compiled.forward)) if math.isnan(compiled.forward[r]) or math.isnan(compiled.backward[r])}
+  tainted = {chem for chem, r in zip(compiled.entry_chem, compiled.entry_rxn) if r in unfavoured}
+  checked = [names[i] for i in range(n_chems) if i not in tainted]
+  if checked:
+    lines.append(f'  if not ({" and ".join(f"isfinite({name})" for name in checked)}):')
+    lines.append(f"    raise FloatingPointError('overflow in generated step')")
+  for i in range(n_chems):
+    # like fmax, nan goes to zero and a negative zero is kept
+    lines.append(f'  c{i} = c{i} if c{i} >= 0.0 else 0.0')
+  lines.append(f'  return [{", ".join(names)}]')
+  return '\n'.join(lines) + '\n'
+
+
+def get_step(compiled):
+  # compiled once per network, shared by every copy with the same fingerprint
+  key = compiled.fingerprint()
+  if key in GENERATED:
+    GENERATED.move_to_end(key)
+  else:
+    namespace = {'nan': float('nan'), 'inf': float('inf'), 'isfinite': math.isfinite}
+    exec(compile(generate_source(compiled), f'<network {key}>', 'exec'), namespace)
+    GENERATED[key] = namespace['step']
+    if len(GENERATED) > MAX_GENERATED:
+      GENERATED.popitem(last=False)
+  return GENERATED[key]
@@ -0,0 +1,385 @@
+import hashlib
+import numpy as np
+from Mapping import Mapping
+from Env import EnvObjectTypes
+from globals import DT, DRAIN_RATE
+from Codegen import get_step
+
+BATTERIES = [Mapping.FOOD_BATTERY, Mapping.WATER_BATTERY]
+# integrators that take the reference explicit step, bit for bit
+EULER_INTEGRATORS = ['euler', 'generated']
+
+
+class CompiledNetwork:
+
+  # 'euler' is the reference, 'implicit' is backward Euler for stiff networks or larger steps,
+  # which with a single Newton iteration is the linearly implicit (Rosenbrock) Euler method,
+  # and 'patankar' keeps concentrations non-negative by construction rather than by clamping,
+  # 'generated' is the explicit step as straight-line python, faster for small networks
+  # and raises FloatingPointError itself once a concentration overflows, a nan from inf - inf is only caught outside reactions between batteries
+  INTEGRATOR = 'euler'
+  NEWTON_ITERS = 8
+  NEWTON_TOL = 1e-10
+
+  def __init__(self, network):
+    # stoichiometry, reactions x chemicals
+    self.lhs_stoich = np.zeros((0, 0))
+    self.rhs_stoich = np.zeros((0, 0))
+    # reactant indices padded with the chemical count, which always holds 1.0 in the state
+    self.lhs_index = np.zeros((0, 1), dtype=int)
+    self.rhs_index = np.zeros((0, 1), dtype=int)
+    # (chemical, reaction, sign) triples in the same order as the object walk
+    self.entry_chem = np.zeros(0, dtype=int)
+    self.entry_rxn = np.zeros(0, dtype=int)
+    self.entry_sign = np.zeros(0)
+
+    self.forward = np.zeros(0)
+    self.backward = np.zeros(0)
+    # flat index into the (side, type) readings
+    self.influence = np.zeros(0, dtype=int)
+
+    # batteries drain at a constant rate instead of decaying
+    self.decay = np.zeros(0)
+    self.drain = np.zeros(0)
+    self.initial_conc = np.zeros(0)
+    # formula lengths, conserved by every reaction
+    self.mass = np.zeros(0)
+    # sparse jacobian, patankar structure, generated step and subnetwork, rebuilt after the network changes
+    self.jacobian_terms = None
+    self.patankar_terms = None
+    self.generated = None
+    self.subnetwork = None
+
+    for chem in network.chemicals:
+      self.add_chemical(chem)
+    for rxn in network.reactions:
+      self.add_reaction(rxn, network.chemicals)
+    self.update_parameters(network)
+    self.reset()
+
+  def add_chemical(self, chem):
+    n_chems = len(self.decay)
+    self.lhs_stoich = np.hstack((self.lhs_stoich, np.zeros((len(self.lhs_stoich), 1))))
+    self.rhs_stoich = np.hstack((self.rhs_stoich, np.zeros((len(self.rhs_stoich), 1))))
+    # the padding index moves along with the chemical count
+    self.lhs_index[self.lhs_index == n_chems] = n_chems + 1
+    self.rhs_index[self.rhs_index == n_chems] = n_chems + 1
+    battery = n_chems in BATTERIES
+    self.decay = np.append(self.decay, 0.0 if battery else chem.decay)
+    self.drain = np.append(self.drain, DRAIN_RATE if battery else 0.0)
+    self.initial_conc = np.append(self.initial_conc, chem.initial_conc)
+    self.mass = np.append(self.mass, len(chem.formula))
+    self.jacobian_terms = None
+    self.patankar_terms = None
+    self.generated = None
+    self.subnetwork = None
+    self.reset()
+
+  def add_reaction(self, rxn, chemicals):
+    index = {id(chem): i for i, chem in enumerate(chemicals)}
+    n_chems = len(self.decay)
+    r = len(self.forward)
+    width = max(self.lhs_index.shape[1], len(rxn.lhs), len(rxn.rhs))
+    if width > self.lhs_index.shape[1]:
+      pad = np.full((r, width - self.lhs_index.shape[1]), n_chems)
+      self.lhs_index = np.hstack((self.lhs_index, pad))
+      self.rhs_index = np.hstack((self.rhs_index, pad))
+
+    lhs_stoich = np.zeros((1, n_chems))
+    rhs_stoich = np.zeros((1, n_chems))
+    lhs_index = np.full((1, width), n_chems)
+    rhs_index = np.full((1, width), n_chems)
+    entries = []
+    for k, chem in enumerate(rxn.lhs):
+      lhs_stoich[0, index[id(chem)]] += 1
+      lhs_index[0, k] = index[id(chem)]
+      entries.append((index[id(chem)], -1.0))
+    for k, chem in enumerate(rxn.rhs):
+      rhs_stoich[0, index[id(chem)]] += 1
+      rhs_index[0, k] = index[id(chem)]
+      entries.append((index[id(chem)], 1.0))
+    self.lhs_stoich = np.vstack((self.lhs_stoich, lhs_stoich))
+    self.rhs_stoich = np.vstack((self.rhs_stoich, rhs_stoich))
+    self.lhs_index = np.vstack((self.lhs_index, lhs_index))
+    self.rhs_index = np.vstack((self.rhs_index, rhs_index))
+    self.entry_chem = np.append(self.entry_chem, [e[0] for e in entries]).astype(int)
+    self.entry_rxn = np.append(self.entry_rxn, [r] * len(entries)).astype(int)
+    self.entry_sign = np.append(self.entry_sign, [e[1] for e in entries])
+
+    self.forward = np.append(self.forward, rxn.forward)
+    self.backward = np.append(self.backward, rxn.backward)
+    self.influence = np.append(self.influence, rxn.influence_side * len(EnvObjectTypes) + rxn.influence_type).astype(int)
+    self.jacobian_terms = None
+    self.patankar_terms = None
+    self.generated = None
+    self.subnetwork = None
+
+  def remove_reaction(self, r):
+    self.lhs_stoich = np.delete(self.lhs_stoich, r, axis=0)
+    self.rhs_stoich = np.delete(self.rhs_stoich, r, axis=0)
+    self.lhs_index = np.delete(self.lhs_index, r, axis=0)
+    self.rhs_index = np.delete(self.rhs_index, r, axis=0)
+    keep = self.entry_rxn != r
+    self.entry_chem = self.entry_chem[keep]
+    self.entry_sign = self.entry_sign[keep]
+    self.entry_rxn = self.entry_rxn[keep]
+    self.entry_rxn[self.entry_rxn > r] -= 1
+    self.forward = np.delete(self.forward, r)
+    self.backward = np.delete(self.backward, r)
+    self.influence = np.delete(self.influence, r)
+    self.jacobian_terms = None
+    self.patankar_terms = None
+    self.generated = None
+    self.subnetwork = None
+
+  def swap_chemicals(self, i, j):
+    perm = np.arange(len(self.decay) + 1)
+    perm[i], perm[j] = j, i
+    self.lhs_stoich[:, [i, j]] = self.lhs_stoich[:, [j, i]]
+    self.rhs_stoich[:, [i, j]] = self.rhs_stoich[:, [j, i]]
+    self.lhs_index = perm[self.lhs_index]
+    self.rhs_index = perm[self.rhs_index]
+    self.entry_chem = perm[self.entry_chem]
+    self.mass[[i, j]] = self.mass[[j, i]]
+    self.jacobian_terms = None
+    self.patankar_terms = None
+    self.generated = None
+    self.subnetwork = None
+    # parameters are refreshed by update_parameters once the chemicals have mutated
+
+  def update_parameters(self, network):
+    # rates follow the potentials, so every reaction may have changed
+    for r, rxn in enumerate(network.reactions):
+      self.forward[r] = rxn.forward
+      self.backward[r] = rxn.backward
+      self.influence[r] = rxn.influence_side * len(EnvObjectTypes) + rxn.influence_type
+    for i, chem in enumerate(network.chemicals):
+      self.decay[i] = 0.0 if i in BATTERIES else chem.decay
+      self.initial_conc[i] = chem.initial_conc
+    self.generated = None
+    self.subnetwork = None
+
+  def to_array(self):
+    # flat float layout, so networks can be packed into shared memory
+    header = [len(self.decay), len(self.forward), self.lhs_index.shape[1], len(self.entry_chem)]
+    return np.concatenate([header, self.lhs_index.ravel(), self.rhs_index.ravel(), self.entry_chem, self.entry_rxn, self.entry_sign,
+                           self.forward, self.backward, self.influence, self.decay, self.drain, self.initial_conc, self.mass]).astype(float)
+
+  @classmethod
+  def from_array(cls, array):
+    n_chems, n_rxns, width, n_entries = array[:4].astype(int)
+    sizes = [n_rxns * width, n_rxns * width, n_entries, n_entries, n_entries, n_rxns, n_rxns, n_rxns, n_chems, n_chems, n_chems]
+    parts = np.split(np.array(array[4:4 + sum(sizes) + n_chems]), np.cumsum(sizes))
+    compiled = cls.__new__(cls)
+    compiled.lhs_index = parts[0].astype(int).reshape(n_rxns, width)
+    compiled.rhs_index = parts[1].astype(int).reshape(n_rxns, width)
+    compiled.entry_chem = parts[2].astype(int)
+    compiled.entry_rxn = parts[3].astype(int)
+    compiled.entry_sign = parts[4]
+    compiled.forward = parts[5]
+    compiled.backward = parts[6]
+    compiled.influence = parts[7].astype(int)
+    compiled.decay = parts[8]
+    compiled.drain = parts[9]
+    compiled.initial_conc = parts[10]
+    compiled.mass = parts[11]
+    compiled.jacobian_terms = None
+    compiled.patankar_terms = None
+    compiled.generated = None
+    compiled.subnetwork = None
+    compiled.lhs_stoich = np.zeros((n_rxns, n_chems + 1))
+    compiled.rhs_stoich = np.zeros((n_rxns, n_chems + 1))
+    rows = np.repeat(np.arange(n_rxns), width)
+    np.add.at(compiled.lhs_stoich, (rows, compiled.lhs_index.ravel()), 1)
+    np.add.at(compiled.rhs_stoich, (rows, compiled.rhs_index.ravel()), 1)
+    compiled.lhs_stoich = compiled.lhs_stoich[:, :n_chems]
+    compiled.rhs_stoich = compiled.rhs_stoich[:, :n_chems]
+    compiled.reset()
+    return compiled
+
+  def fingerprint(self):
+    return hashlib.blake2b(self.to_array().tobytes(), digest_size=16).hexdigest()
+
+  def clone(self):
+    # independent copy at the initial concentrations, e.g. for another trial
+    return CompiledNetwork.from_array(self.to_array())
+
+  def get_relevant(self):
+    # chemicals that can change the outputs or batteries, and the reactions between them,
+    # found backwards through every reaction that changes a relevant chemical, since all its reactants set its rate
+    reactants = (self.lhs_stoich + self.rhs_stoich) > 0
+    chems = np.arange(len(self.decay)) < len(Mapping)
+    while True:
+      rxns = np.any(reactants[:, chems], axis=1)
+      grown = chems | np.any(reactants[rxns], axis=0)
+      if np.array_equal(grown, chems):
+        return chems, rxns
+      chems = grown
+
+  def pruned(self):
+    # the relevant subnetwork, simulating the outputs and batteries exactly, at the current concentrations
+    if self.subnetwork is None:
+      chems, rxns = self.get_relevant()
+      if np.all(chems):
+        self.subnetwork = (chems, self)
+      else:
+        # renumbered in the same order, so the mapping chemicals keep their indices
+        remap = np.full(len(chems) + 1, np.count_nonzero(chems))
+        remap[np.flatnonzero(chems)] = np.arange(np.count_nonzero(chems))
+        rxn_map = np.cumsum(rxns) - 1
+        keep = rxns[self.entry_rxn]
+        header = [np.count_nonzero(chems), np.count_nonzero(rxns), self.lhs_index.shape[1], np.count_nonzero(keep)]
+        array = np.concatenate([header, remap[self.lhs_index[rxns]].ravel(), remap[self.rhs_index[rxns]].ravel(), remap[self.entry_chem[keep]],
+                                rxn_map[self.entry_rxn[keep]], self.entry_sign[keep], self.forward[rxns], self.backward[rxns], self.influence[rxns],
+                                self.decay[chems], self.drain[chems], self.initial_conc[chems], self.mass[chems]]).astype(float)
+        self.subnetwork = (chems, CompiledNetwork.from_array(array))
+    chems, subnetwork = self.subnetwork
+    if subnetwork is not self:
+      subnetwork.reset()
+      subnetwork.conc[:] = self.conc[chems]
+    return subnetwork
+
+  def unpruned(self, subnetwork):
+    # back to the full network, at the concentrations its subnetwork reached
+    if subnetwork is not self:
+      chems, _ = self.subnetwork
+      self.conc[chems] = subnetwork.conc
+    return self
+
+  def bind(self, state):
+    # move the concentrations into a row of a larger array, padded with 1.0
+    state[:len(self.conc)] = self.conc
+    self.state = state
+    self.conc = state[:len(self.conc)]
+
+  def reset(self):
+    self.state = np.ones(len(self.initial_conc) + 1)
+    self.conc = self.state[:len(self.initial_conc)]
+    self.conc[:] = self.initial_conc
+
+  def get_derivs(self, readings):
+    influence = np.exp(np.ravel(readings)[self.influence])
+    lhs_product = np.multiply.reduce(self.state[self.lhs_index], axis=1)
+    rhs_product = np.multiply.reduce(self.state[self.rhs_index], axis=1)
+    # net rate from lhs to rhs for each reaction
+    flux = lhs_product * self.forward * influence - rhs_product * self.backward * influence
+
+    dconc = self.drain - self.decay * self.conc
+    np.add.at(dconc, self.entry_chem, self.entry_sign * flux[self.entry_rxn])
+    return dconc
+
+  def build_jacobian(self):
+    # one term per entry and reactant of its reaction, summed into the sparse pattern along with the decays
+    n_chems = len(self.decay)
+    n_rxns, width = self.lhs_index.shape
+    rows, cols, terms, signs = [], [], [], []
+    for chem, r, sign in zip(self.entry_chem, self.entry_rxn, self.entry_sign):
+      for side, (index, side_sign) in enumerate(((self.lhs_index, 1.0), (self.rhs_index, -1.0))):
+        for slot in range(width):
+          if index[r, slot] < n_chems:
+            rows.append(chem)
+            cols.append(index[r, slot])
+            terms.append((r * 2 + side) * width + slot)
+            signs.append(sign * side_sign)
+    pairs = np.concatenate([np.array(rows, dtype=int) * n_chems + np.array(cols, dtype=int), np.arange(n_chems) * (n_chems + 1)])
+    pattern, entry = np.unique(pairs, return_inverse=True)
+    self.jacobian_terms = (pattern // n_chems, pattern % n_chems, entry[:len(rows)], np.array(terms, dtype=int), np.array(signs), entry[len(rows):])
+
+  def get_partials(self, readings):
+    # each directional flux divided by one of its reactants, reaction x side x slot
+    influence = np.exp(np.ravel(readings)[self.influence])
+    n_rxns, width = self.lhs_index.shape
+    partial = np.zeros((n_rxns, 2, width))
+    for slot in range(width):
+      lhs = self.state[self.lhs_index]
+      lhs[:, slot] = 1.0
+      rhs = self.state[self.rhs_index]
+      rhs[:, slot] = 1.0
+      partial[:, 0, slot] = np.multiply.reduce(lhs, axis=1) * self.forward * influence
+      partial[:, 1, slot] = np.multiply.reduce(rhs, axis=1) * self.backward * influence
+    return partial
+
+  def get_sparse_jacobian(self, readings):
+    # derivative of get_derivs by each concentration, as (row, column, value) triples
+    if self.jacobian_terms is None:
+      self.build_jacobian()
+    rows, cols, entry, terms, signs, diagonal = self.jacobian_terms
+    partial = self.get_partials(readings)
+    # without reactions bincount has no weights to sum and returns ints
+    values = np.bincount(entry, weights=signs * partial.ravel()[terms], minlength=len(rows)).astype(float)
+    values[diagonal] -= self.decay
+    return rows, cols, values
+
+  def get_jacobian(self, readings):
+    rows, cols, values = self.get_sparse_jacobian(readings)
+    jacobian = np.zeros((len(self.conc), len(self.conc)))
+    jacobian[rows, cols] = values
+    return jacobian
+
+  def step_implicit(self, readings):
+    # solve conc = previous + get_derivs(conc) * DT by Newton iterations, kept non-negative
+    previous = self.conc.copy()
+    # chemicals with undefined rates go to zero, as the explicit step clamps them
+    free = ~np.isnan(self.get_derivs(readings))
+    self.conc[~free] = 0.0
+    identity = np.eye(np.count_nonzero(free))
+    for _ in range(CompiledNetwork.NEWTON_ITERS):
+      residual = self.conc[free] - previous[free] - self.get_derivs(readings)[free] * DT
+      step = np.linalg.solve(identity - self.get_jacobian(readings)[np.ix_(free, free)] * DT, residual)
+      self.conc[free] = np.fmax(self.conc[free] - step, 0.0)
+      if np.all(np.abs(step) <= CompiledNetwork.NEWTON_TOL * (1 + np.abs(self.conc[free]))):
+        break
+
+  def build_patankar(self):
+    # every source of a directional flux feeds each target in proportion to the target's share of the mass,
+    # so the system matrix conserves mass and has a non-negative inverse
+    n_chems = len(self.decay)
+    n_rxns, width = self.lhs_index.shape
+    rows, cols, terms, coefs = [], [], [], []
+    for r in range(n_rxns):
+      for side, (sources, targets) in enumerate(((self.lhs_index[r], self.rhs_index[r]), (self.rhs_index[r], self.lhs_index[r]))):
+        sources, targets = [(slot, chem) for slot, chem in enumerate(sources) if chem < n_chems], [chem for chem in targets if chem < n_chems]
+        total = sum(self.mass[chem] for chem in targets)
+        for slot, source in sources:
+          rows.append(source)
+          cols.append(source)
+          terms.append((r * 2 + side) * width + slot)
+          coefs.append(1.0)
+          for target in targets:
+            rows.append(target)
+            cols.append(source)
+            terms.append((r * 2 + side) * width + slot)
+            coefs.append(-self.mass[source] / total)
+    self.patankar_terms = (np.array(rows, dtype=int), np.array(cols, dtype=int), np.array(terms, dtype=int), np.array(coefs))
+
+  def step_patankar(self, readings):
+    # modified Patankar Euler, a linear solve for the new concentrations with every flux
+    # weighted by new over old concentration of its source, batteries then drain explicitly
+    if self.patankar_terms is None:
+      self.build_patankar()
+    rows, cols, terms, coefs = self.patankar_terms
+    system = np.diag(1 + self.decay * DT)
+    np.add.at(system, (rows, cols), coefs * self.get_partials(readings).ravel()[terms] * DT)
+    # chemicals with undefined rates go to zero, as the explicit step clamps them
+    free = ~np.isnan(np.diag(system))
+    conc = np.zeros(len(self.conc))
+    conc[free] = np.linalg.solve(system[np.ix_(free, free)], self.conc[free])
+    conc[BATTERIES] = np.fmax(conc[BATTERIES] + self.drain[BATTERIES] * DT, 0.0)
+    self.conc[:] = conc
+
+  def get_outputs(self, readings):
+    if CompiledNetwork.INTEGRATOR == 'implicit':
+      self.step_implicit(readings)
+    elif CompiledNetwork.INTEGRATOR == 'patankar':
+      self.step_patankar(readings)
+    elif CompiledNetwork.INTEGRATOR == 'generated':
+      if self.generated is None:
+        self.generated = get_step(self)
+      self.conc[:] = self.generated(self.conc.tolist(), np.exp(np.ravel(readings)).tolist())
+    else:
+      dconc = self.get_derivs(readings)
+      # fmax treats nan as missing, like the builtin max of the object walk
+      np.fmax(self.conc + dconc * DT, 0.0, out=self.conc)
+
+    # return chemicals of interest
+    return self.conc[:len(Mapping)]
@@ -1,4 +1,5 @@
 import numpy as np, matplotlib.pyplot as plt, math
+from collections import OrderedDict
 from enum import IntEnum
 
 class EnvObjectTypes(IntEnum):
@@ -17,7 +18,11 @@ class EnvObject:
 
   def __init__(self, type, rstate, loc = None):
     self.type = type
-    self.rstate = np.random.default_rng(rstate)
+    # shared with the other objects of the env, anything with a random() method
+    self.rstate = rstate
+    # set by the grid that indexes this object
+    self.grid = None
+    self.index = None
 
     if loc is None:
       self.x = self.rstate.random() - 0.5
@@ -35,6 +40,147 @@ class EnvObject:
   def reset(self):
     self.x = self.rstate.random() - 0.5
     self.y = self.rstate.random() - 0.5
+    if self.grid is not None:
+      self.grid.move(self.index)
+
+  def __getstate__(self):
+    # copies must not move the original in the grid, their env indexes them again
+    state = self.__dict__.copy()
+    state['grid'] = None
+    return state
+
+class Layout:
+
+  CHUNK = 1024
+
+  def __init__(self, rstate):
+    # initial positions and respawn draws of one seed, shared by every env built from it
+    self.rstate = np.random.default_rng(rstate)
+    # drawn object by object, x then y, in type order
+    n_objects = sum(Env.N_OBJECTS[type] for type in EnvObjectTypes)
+    self.initial = (self.rstate.random(2 * n_objects) - 0.5).reshape(-1, 2)
+    self.draws = np.zeros(0)
+
+  def draw(self, n):
+    # the stream continues where it left off, so the table only ever grows
+    while n >= len(self.draws):
+      self.draws = np.concatenate((self.draws, self.rstate.random(Layout.CHUNK)))
+    return self.draws[n]
+
+class Stream:
+
+  def __init__(self, layout):
+    # one env's position in its layout's draws, in place of a generator
+    self.layout = layout
+    self.index = 0
+
+  def random(self):
+    value = self.layout.draw(self.index)
+    self.index += 1
+    return value
+
+class Grid:
+
+  OBJECTS_PER_CELL = 4
+
+  def __init__(self, objects):
+    # uniform grid over the arena, each cell holds the indices of its objects
+    self.objects = objects
+    self.n_cells = max(1, math.floor(math.sqrt(len(objects) / Grid.OBJECTS_PER_CELL)))
+    self.cell_size = (Env.MAX_X - Env.MIN_X) / self.n_cells
+    self.cells = [[[] for _ in range(self.n_cells)] for _ in range(self.n_cells)]
+    self.cell_of = [None for _ in objects]
+    for k, object in enumerate(objects):
+      object.grid = self
+      object.index = k
+      self.insert(k)
+
+  def cell(self, x, y):
+    # points outside the arena belong to the nearest edge cell
+    i = min(max(math.floor((x - Env.MIN_X) / self.cell_size), 0), self.n_cells - 1)
+    j = min(max(math.floor((y - Env.MIN_Y) / self.cell_size), 0), self.n_cells - 1)
+    return i, j
+
+  def insert(self, k):
+    i, j = self.cell(self.objects[k].x, self.objects[k].y)
+    self.cells[i][j].append(k)
+    self.cell_of[k] = (i, j)
+
+  def move(self, k):
+    i, j = self.cell_of[k]
+    self.cells[i][j].remove(k)
+    self.insert(k)
+
+  def ring(self, ci, cj, r):
+    # cells at chessboard distance r from (ci, cj)
+    for i in range(max(ci - r, 0), min(ci + r, self.n_cells - 1) + 1):
+      if abs(i - ci) == r:
+        rows = range(max(cj - r, 0), min(cj + r, self.n_cells - 1) + 1)
+      else:
+        rows = [j for j in (cj - r, cj + r) if 0 <= j < self.n_cells]
+      for j in rows:
+        yield self.cells[i][j]
+
+  def nearest(self, x, y):
+    # search rings outwards until no unvisited cell can hold a closer object
+    # ties go to the lowest index, like a linear scan with a strict comparison
+    best = None
+    min_dsq = math.inf
+    if self.n_cells == 1:
+      # a single cell is a plain scan
+      for k, object in enumerate(self.objects):
+        dsq = (x - object.x)**2 + (y - object.y)**2
+        if dsq < min_dsq:
+          min_dsq = dsq
+          best = object
+      return best, min_dsq
+    ci, cj = self.cell(x, y)
+    for r in range(self.n_cells):
+      for cell in self.ring(ci, cj, r):
+        for k in cell:
+          object = self.objects[k]
+          dsq = (x - object.x)**2 + (y - object.y)**2
+          if dsq < min_dsq or (dsq == min_dsq and k < best):
+            min_dsq = dsq
+            best = k
+      # distance to the edge of the visited square, open on the arena sides
+      bound = math.inf
+      if ci - r > 0:
+        bound = min(bound, x - (Env.MIN_X + (ci - r) * self.cell_size))
+      if ci + r < self.n_cells - 1:
+        bound = min(bound, Env.MIN_X + (ci + r + 1) * self.cell_size - x)
+      if cj - r > 0:
+        bound = min(bound, y - (Env.MIN_Y + (cj - r) * self.cell_size))
+      if cj + r < self.n_cells - 1:
+        bound = min(bound, Env.MIN_Y + (cj + r + 1) * self.cell_size - y)
+      # small margin so rounding never hides a tie
+      if min_dsq < bound**2 * (1 - 1e-9):
+        break
+    return (None if best is None else self.objects[best]), min_dsq
+
+class ConsumptionLog:
+
+  DTYPE = np.dtype([('step', np.int32), ('type', np.int8), ('x', np.float64), ('y', np.float64)])
+  INITIAL_SIZE = 16
+
+  def __init__(self, records=None):
+    # one (step, type, x, y) record per consumed object, doubled when full
+    records = np.zeros(0, dtype=ConsumptionLog.DTYPE) if records is None else records
+    self.events = np.zeros(max(len(records), ConsumptionLog.INITIAL_SIZE), dtype=ConsumptionLog.DTYPE)
+    self.events[:len(records)] = records
+    self.size = len(records)
+
+  def append(self, step, type, x, y):
+    if self.size == len(self.events):
+      self.events = np.concatenate((self.events, np.zeros(len(self.events), dtype=ConsumptionLog.DTYPE)))
+    self.events[self.size] = (step, type, x, y)
+    self.size += 1
+
+  def records(self):
+    return self.events[:self.size]
+
+  def __len__(self):
+    return self.size
 
 class Env:
 
@@ -43,19 +189,47 @@ class Env:
   MIN_X = -0.5
   MIN_Y = -0.5
   N_OBJECTS = [2, 2, 0]
+  MAX_LAYOUTS = 16
+  layouts = OrderedDict()
 
   def __init__(self, rstate):
-    self.rstate = np.random.default_rng(rstate)
-    self.objects = [ [ EnvObject(type=str(type.name), rstate=self.rstate) for i in range(Env.N_OBJECTS[type]) ] for type in EnvObjectTypes ]
-    self.consumed = []
+    # envs of the same seed share one layout and only own their object positions
+    self.layout = Env.get_layout(rstate)
+    self.rstate = Stream(self.layout)
+    locs = iter(self.layout.initial)
+    self.objects = [ [ EnvObject(type=str(type.name), rstate=self.rstate, loc=next(locs)) for i in range(Env.N_OBJECTS[type]) ] for type in EnvObjectTypes ]
+    self.grids = [ Grid(objects) for objects in self.objects ]
+    self.consumed = ConsumptionLog()
+
+  @staticmethod
+  def get_layout(rstate):
+    # only integer seeds are cached, generators cannot be shared, None draws a fresh layout and lists are unhashable
+    if not isinstance(rstate, (int, np.integer)):
+      return Layout(rstate)
+    key = (rstate, tuple(Env.N_OBJECTS))
+    if key in Env.layouts:
+      Env.layouts.move_to_end(key)
+    else:
+      Env.layouts[key] = Layout(rstate)
+      if len(Env.layouts) > Env.MAX_LAYOUTS:
+        Env.layouts.popitem(last=False)
+    return Env.layouts[key]
+
+  def __setstate__(self, state):
+    # objects are copied without their grid, so index them again
+    self.__dict__.update(state)
+    self.grids = [ Grid(objects) for objects in self.objects ]
+
+  def find_nearest(self, type, x, y):
+    return self.grids[type].nearest(x, y)
   
   def plot(self, axis):
     colors = ['g', 'b', 'r']
     for type in EnvObjectTypes:
       for object in self.objects[type]:
         axis.add_patch(plt.Circle((object.x, object.y), EnvObject.RADIUS, color=colors[type]))
-    for object in self.consumed:
-      axis.add_patch(plt.Circle((object.x, object.y), EnvObject.RADIUS, color=colors[EnvObjectTypes[object.type]], fill=False))
+    for event in self.consumed.records():
+      axis.add_patch(plt.Circle((event['x'], event['y']), EnvObject.RADIUS, color=colors[event['type']], fill=False))
       
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+import multiprocessing as mp
+import numpy as np
+import Network as network_module
+import Population as population_module
+from Animat import Animat
+from Network import Network
+from Population import Population
+
+
+def ring(island, n_islands):
+  return [(island + 1) % n_islands]
+
+
+def fully_connected(island, n_islands):
+  return [other for other in range(n_islands) if other != island]
+
+
+TOPOLOGIES = {'ring': ring, 'all': fully_connected}
+
+
+def run_island(island, model, inboxes, results):
+  # every island draws its own populations and tournaments
+  network_module.NETWORK_RNG = np.random.default_rng([island, 814486224])
+  population_module.POP_RNG = np.random.default_rng([island, 123456789])
+  targets = TOPOLOGIES[model.topology](island, model.n_islands)
+  n_sources = sum(island in TOPOLOGIES[model.topology](other, model.n_islands) for other in range(model.n_islands))
+
+  pop = Population()
+  history = []
+  for generation in range(model.n_generations):
+    max, mean, min, best = pop.eval(model.seed(island, generation))
+    history.append((max, mean, min))
+    champion = best.controller.to_bytes()
+    migrate = model.interval and (generation + 1) % model.interval == 0
+    if migrate:
+      for target in targets:
+        inboxes[target].put(champion)
+    # migrants replace the worst individuals of this generation
+    worst = np.argsort([animat.fitness for animat in pop.animats])[:n_sources]
+    pop.evolve()
+    if migrate:
+      for i in worst:
+        pop.animats[i] = Animat(Network.from_bytes(inboxes[island].get()))
+  results.put((island, history, champion))
+
+
+class IslandModel:
+
+  SEED_STRIDE = 1000
+  SEED_PERIOD = 400
+
+  def __init__(self, n_islands=None, topology='ring', interval=20, n_generations=400):
+    self.n_islands = n_islands or mp.cpu_count()
+    self.topology = topology
+    self.interval = interval
+    self.n_generations = n_generations
+
+  def seed(self, island, generation):
+    # each island keeps its own env seed, changed every SEED_PERIOD generations
+    return island * IslandModel.SEED_STRIDE + generation // IslandModel.SEED_PERIOD
+
+  def run(self):
+    # queues stand in for the links between machines, only serialized networks go through them
+    inboxes = [mp.Queue() for _ in range(self.n_islands)]
+    results = mp.Queue()
+    processes = [mp.Process(target=run_island, args=(island, self, inboxes, results)) for island in range(self.n_islands)]
+    for process in processes:
+      process.start()
+    outcomes = sorted([results.get() for _ in processes], key=lambda outcome: outcome[0])
+    for process in processes:
+      process.join()
+    histories = [history for _, history, _ in outcomes]
+    champions = [Network.from_bytes(champion) for _, _, champion in outcomes]
+    return histories, champions
+
+
+if __name__ == '__main__':
+  model = IslandModel()
+  histories, champions = model.run()
+  for island, history in enumerate(histories):
+    print('island', island, 'max:', round(history[-1][0], 3))
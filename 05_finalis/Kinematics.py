@@ -0,0 +1,53 @@
+import math
+import numpy as np
+from Animat import Animat
+from globals import DT
+
+
+class Kinematics:
+
+  def __init__(self, animats):
+    # one entry per animat, so the whole population moves in lockstep
+    self.x = np.array([animat.x for animat in animats], dtype=float)
+    self.y = np.array([animat.y for animat in animats], dtype=float)
+    self.theta = np.array([animat.theta for animat in animats], dtype=float)
+    self.dx = np.zeros(len(animats))
+    self.dy = np.zeros(len(animats))
+    self.dtheta = np.zeros(len(animats))
+    self.fitness = np.array([animat.fitness for animat in animats], dtype=float)
+    self.alive = np.array([animat.alive for animat in animats], dtype=bool)
+
+  def act(self, live, left_motor_state, right_motor_state):
+    # calculate derivs
+    mag = (left_motor_state + right_motor_state) / 2
+    theta = self.theta[live]
+    self.dx[live] = mag * np.cos(theta)
+    self.dy[live] = mag * np.sin(theta)
+    self.dtheta[live] = (right_motor_state - left_motor_state) / Animat.RADIUS
+
+  def move(self, live):
+    # update position and orientation
+    self.x[live] += self.dx[live] * DT
+    self.y[live] += self.dy[live] * DT
+    theta = self.theta[live] + self.dtheta[live] * DT
+    # wrap one turn at a time, like the per-animat loops
+    while np.any(theta > 2*math.pi):
+      theta = np.where(theta > 2*math.pi, theta - 2*math.pi, theta)
+    while np.any(theta < 0):
+      theta = np.where(theta < 0, theta + 2*math.pi, theta)
+    self.theta[live] = theta
+
+  def accumulate(self, live, battery_agg):
+    self.fitness[live] += battery_agg * DT * 10
+    self.alive[live] &= ~(battery_agg <= 0)
+
+  def write_back(self, animats):
+    for k, animat in enumerate(animats):
+      animat.x = self.x[k]
+      animat.y = self.y[k]
+      animat.theta = self.theta[k]
+      animat.dx = self.dx[k]
+      animat.dy = self.dy[k]
+      animat.dtheta = self.dtheta[k]
+      animat.fitness = self.fitness[k]
+      animat.alive = bool(self.alive[k])
@@ -3,9 +3,12 @@ import math
 from Sides import Sides
 from collections import Counter
 import copy
+import hashlib
+import pickle
 import numpy as np
 from Env import EnvObjectTypes
 from Mapping import Mapping
+from Compiled import CompiledNetwork
 from globals import DT, AGGREGATION, MUTATION_RATE, DRAIN_RATE
 
 
@@ -149,6 +152,7 @@ class Network:
   N_INIT_REACTIONS = 6
 
   def __init__(self):
+    self.compiled = None
     self.chemicals = []
     while len(self.chemicals) < Network.N_INIT_CHEMICALS:
       formula = rand_formula(min_len = 1)
@@ -175,6 +179,8 @@ class Network:
       chem.conc = chem.initial_conc
       chem.dconc = 0
       chem.hist = [chem.initial_conc]
+    if deep_copy.compiled is not None:
+      deep_copy.compiled.reset()
     return deep_copy
 
   def __repr__(self):
@@ -183,6 +189,57 @@ class Network:
   def __str__(self):
     return ' '.join([repr(chemical) for chemical in self.chemicals]) + '\n' + '\n'.join([repr(reaction) for reaction in self.reactions])
 
+  def fingerprint(self):
+    # hash of everything that defines the network, independent of its current state
+    index = {id(chem): i for i, chem in enumerate(self.chemicals)}
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.array([len(self.chemicals), len(self.reactions)]).tobytes())
+    for chem in self.chemicals:
+      digest.update(f'{chem.formula}|'.encode())
+      digest.update(np.array([chem.potential, chem.initial_conc, chem.decay], dtype=float).tobytes())
+    for rxn in self.reactions:
+      digest.update(np.array([len(rxn.lhs), len(rxn.rhs), rxn.influence_type, rxn.influence_side] + [index[id(chem)] for chem in rxn.lhs] + [index[id(chem)] for chem in rxn.rhs]).tobytes())
+      digest.update(np.array([rxn.fav_rate, rxn.forward, rxn.backward], dtype=float).tobytes())
+    return digest.hexdigest()
+
+  def to_bytes(self):
+    # compact form of everything fingerprint covers, e.g. to send to another process
+    index = {id(chem): i for i, chem in enumerate(self.chemicals)}
+    formulas = '|'.join([chem.formula for chem in self.chemicals])
+    chems = np.array([[chem.potential, chem.initial_conc, chem.decay] for chem in self.chemicals], dtype=float).reshape(-1, 3)
+    rates = np.array([[rxn.fav_rate, rxn.forward, rxn.backward] for rxn in self.reactions], dtype=float).reshape(-1, 3)
+    structure = np.array([[len(rxn.lhs), len(rxn.rhs), rxn.influence_type, rxn.influence_side] for rxn in self.reactions], dtype=np.int16).reshape(-1, 4)
+    members = np.array([index[id(chem)] for rxn in self.reactions for chem in list(rxn.lhs) + list(rxn.rhs)], dtype=np.int16)
+    return pickle.dumps((formulas, chems, rates, structure, members), protocol=pickle.HIGHEST_PROTOCOL)
+
+  @classmethod
+  def from_bytes(cls, data):
+    # rebuilt without touching NETWORK_RNG
+    formulas, chems, rates, structure, members = pickle.loads(data)
+    network = cls.__new__(cls)
+    network.compiled = None
+    network.chemicals = []
+    for formula, (potential, initial_conc, decay) in zip(formulas.split('|') if len(chems) else [], chems):
+      chem = Chemical.__new__(Chemical)
+      chem.formula = formula
+      chem.potential, chem.initial_conc, chem.decay = float(potential), float(initial_conc), float(decay)
+      chem.conc = chem.initial_conc
+      chem.dconc = 0
+      chem.hist = [chem.initial_conc]
+      network.chemicals.append(chem)
+    network.reactions = []
+    start = 0
+    for (n_lhs, n_rhs, influence_type, influence_side), (fav_rate, forward, backward) in zip(structure, rates):
+      rxn = Reaction.__new__(Reaction)
+      rxn.lhs = np.array([network.chemicals[i] for i in members[start:start + n_lhs]])
+      rxn.rhs = np.array([network.chemicals[i] for i in members[start + n_lhs:start + n_lhs + n_rhs]])
+      start += n_lhs + n_rhs
+      rxn.fav_rate, rxn.forward, rxn.backward = float(fav_rate), float(forward), float(backward)
+      rxn.influence_type = np.int64(influence_type)
+      rxn.influence_side = np.int64(influence_side)
+      network.reactions.append(rxn)
+    return network
+
   def new_reaction(self):
 
     def decompose(formula):
@@ -220,13 +277,35 @@ class Network:
         new_chem = Chemical(formula)
         self.chemicals.append(new_chem)
         rhs.append(new_chem)
+        if self.compiled is not None:
+          self.compiled.add_chemical(new_chem)
     
     # prevent LHS = RHS
     if not (Counter([lhs_chem.formula for lhs_chem in lhs]) == Counter([rhs_chem.formula for rhs_chem in rhs])):
       self.reactions.append(Reaction(lhs, np.array(rhs)))
+      if self.compiled is not None:
+        self.compiled.add_reaction(self.reactions[-1], self.chemicals)
     return 
   
+  def compile(self):
+    if self.compiled is None:
+      self.compiled = CompiledNetwork(self)
+    else:
+      self.compiled.reset()
+    return self.compiled
+
   def get_outputs(self, readings):
+    if self.compiled is None:
+      self.compile()
+    return self.compiled.get_outputs(readings)
+
+  def get_jacobian(self, readings):
+    # sparse (row, column, value) jacobian of the rates at the current concentrations
+    if self.compiled is None:
+      self.compile()
+    return self.compiled.get_sparse_jacobian(readings)
+
+  def get_outputs_reference(self, readings):
     # set decay
     for i, chemical in enumerate(self.chemicals):
       chemical.prep_update(i)
@@ -244,14 +323,22 @@ class Network:
     if NETWORK_RNG.random() < MUTATION_RATE:
       i = NETWORK_RNG.choice(range(len(self.chemicals)), 2)
       self.chemicals[i[0]], self.chemicals[i[1]] = self.chemicals[i[1]], self.chemicals[i[0]]
+      if self.compiled is not None:
+        self.compiled.swap_chemicals(i[0], i[1])
     for i, chemical in enumerate(self.chemicals):
       chemical.mutate(i)
     for reaction in self.reactions:
       reaction.mutate()
+    # patch the compiled form in place rather than rebuilding it
+    if self.compiled is not None:
+      self.compiled.update_parameters(self)
     if NETWORK_RNG.random() < 5 * MUTATION_RATE or not len(self.reactions):
       self.new_reaction()
     if NETWORK_RNG.random() < 5 * MUTATION_RATE and len(self.reactions):
-      self.reactions.pop(NETWORK_RNG.integers(len(self.reactions)))
+      r = NETWORK_RNG.integers(len(self.reactions))
+      self.reactions.pop(r)
+      if self.compiled is not None:
+        self.compiled.remove_reaction(r)
   
   def print_derivs(self):
     derivs = {}
@@ -0,0 +1,69 @@
+import multiprocessing as mp
+import numpy as np
+from Animat import Animat
+from Env import Env
+from Compiled import CompiledNetwork
+from Batch import evaluate_batch
+from Recording import Recording
+
+WORKER_BUFFER = None
+
+
+def init_worker(buffer):
+  global WORKER_BUFFER
+  WORKER_BUFFER = buffer
+
+
+def get_traces(animat, recording):
+  traces = {'fitness': animat.fitness}
+  if recording != Recording.NONE:
+    for name in ['x', 'y', 'theta', 'alive', 'encountered', 'n_records', 'x_hist', 'y_hist', 'sens_hist', 'motor_hist', 'chem_hist']:
+      traces[name] = getattr(animat, name)
+  return traces
+
+
+def evaluate_chunk(task):
+  seed, recording, spans = task
+  buffer = np.frombuffer(WORKER_BUFFER)
+  animats = [Animat(chemistry=CompiledNetwork.from_array(buffer[start:end])) for start, end in spans]
+  evaluate_batch(animats, [Env(seed) for _ in animats], recording)
+  return [get_traces(animat, recording) for animat in animats]
+
+
+class ParallelEvaluator:
+
+  CHUNKS_PER_WORKER = 4
+
+  def __init__(self, processes=None, capacity=2**18):
+    self.processes = processes or mp.cpu_count()
+    self.pool = None
+    self.start(capacity)
+
+  def start(self, capacity):
+    # networks travel through one shared buffer, so workers only receive offsets
+    self.close()
+    self.buffer = mp.RawArray('d', capacity)
+    self.pool = mp.Pool(self.processes, initializer=init_worker, initargs=(self.buffer,))
+
+  def close(self):
+    if self.pool is not None:
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
+
+  def evaluate(self, animats, seed, recording=Recording.NONE):
+    arrays = [animat.chemistry.to_array() for animat in animats]
+    ends = np.cumsum([len(array) for array in arrays])
+    if ends[-1] > len(self.buffer):
+      self.start(2 * int(ends[-1]))
+    buffer = np.frombuffer(self.buffer)
+    buffer[:ends[-1]] = np.concatenate(arrays)
+    spans = list(zip(ends - [len(array) for array in arrays], ends))
+
+    n_chunks = min(len(animats), self.processes * ParallelEvaluator.CHUNKS_PER_WORKER)
+    chunks = np.array_split(np.arange(len(animats)), n_chunks)
+    results = self.pool.map(evaluate_chunk, [(seed, recording, [spans[k] for k in chunk]) for chunk in chunks])
+    for chunk, traces in zip(chunks, results):
+      for k, trace in zip(chunk, traces):
+        for name, value in trace.items():
+          setattr(animats[k], name, value)
@@ -1,9 +1,17 @@
 import numpy as np, random, copy, math
+from collections import Counter, namedtuple
 import matplotlib.pyplot as plt
 from Animat import Animat
 from Env import Env
+from Batch import evaluate_batch, BatchedTrial
+from Recording import Recording
+from Cache import FitnessCache
+from Parallel import ParallelEvaluator
+from globals import DT
 
 POP_RNG = np.random.default_rng(123456789)
+# one simulation of individual i on its k-th env seed, filling in fitnesses[k]
+Trial = namedtuple('Trial', ['animat', 'seed', 'fitnesses', 'key', 'k', 'i'])
 
 class Population:
   SIZE = 100
@@ -11,7 +19,15 @@ class Population:
   CROSS = 0.5
   MUT = 0.04
   N_TOUR_ROUNDS = 10
-  def __init__(self):
+  STATS_INTERVAL = 10
+  HALVING_RUNGS = 4
+  HALVING_KEEP = 0.5
+  def __init__(self, processes=None, lazy=False, halving=False, pruning=False):
+    # the race and the thresholds run in this process, the pool would simulate everyone to full lifetime
+    if processes and halving:
+      raise ValueError('successive halving cannot be combined with a process pool')
+    if processes and pruning:
+      raise ValueError('pruning cannot be combined with a process pool')
     self.animats = []
     # while len(self.animats) < Population.SIZE:
     #   animat = Animat()
@@ -20,28 +36,171 @@ class Population:
     #     print(f'Triage {len(self.animats)}')
     #     self.animats.append(Animat(animat.controller.deep_copy()))
     self.animats = [Animat() for _ in range(Population.SIZE)]
-  
-  def eval(self, generation):
-    fitnesses = [None] * Population.SIZE
-    for i, animat in enumerate(self.animats):
-      env = Env(generation)
-      animat.evaluate(env)
-      fitnesses[i] = animat.fitness
+    self.cache = FitnessCache()
+    self.evaluator = ParallelEvaluator(processes) if processes else None
+    # when lazy, individuals are only simulated once drawn into a tournament
+    self.lazy = lazy
+    # when halving, only the best of each short horizon go on to the next
+    self.halving = halving
+    # when pruning as well as lazy, a tournament's second simulation stops once it is settled
+    self.pruning = pruning
+    self.seeds = None
+    self.batched = True
+    self.generation = 0
+    self.evaluated = set()
+    self.pairs = None
+
+  def evaluate(self, indices, seeds, batched=True, recording=Recording.NONE, simulate=True, must_beat=None):
+    # unchanged networks on the same env seeds keep their fitness, unless a recording is needed
+    if seeds != self.seeds:
+      self.seeds = seeds
+      self.evaluated = set()
+    # thresholds only apply to single seed runs to full lifetime
+    must_beat = must_beat if must_beat and len(seeds) == 1 and not self.halving else {}
+    pending = []
+    for i in indices:
+      keys = [self.cache.key(self.animats[i].controller, seed) for seed in seeds]
+      # a complete run is cached with its partial fitnesses, to compare against individuals that were stopped
+      entries = [self.cache.get(key) if recording == Recording.NONE else None for key in keys]
+      fitnesses = [None if entry is None else entry[0] for entry in entries]
+      if None in fitnesses:
+        pending.append((i, keys, fitnesses))
+      else:
+        self.set_fitness(i, fitnesses)
+        self.animats[i].rung_fitness = dict(entries[0][1])
+    if not simulate:
+      return
+
+    # the first seed is simulated by the individual itself, any other by a copy of its compiled network
+    trials = []
+    for i, keys, fitnesses in pending:
+      for k, seed in enumerate(seeds):
+        if fitnesses[k] is None:
+          animat = self.animats[i] if k == 0 else Animat(chemistry=self.animats[i].chemistry.clone())
+          trials.append(Trial(animat, seed, fitnesses, keys[k], k, i))
+
+    if self.evaluator is not None and len(trials):
+      for seed in seeds:
+        animats = [trial.animat for trial in trials if trial.seed == seed]
+        if len(animats):
+          self.evaluator.evaluate(animats, seed, recording)
+    elif batched and len(trials) and self.halving and len(seeds) == 1 and recording == Recording.NONE:
+      self.race([trial.animat for trial in trials], seeds[0])
+    elif batched and len(trials):
+      # every trial of every individual in one batch
+      evaluate_batch([trial.animat for trial in trials], [Env(trial.seed) for trial in trials], recording,
+                     [must_beat.get(trial.i, np.nan) for trial in trials] if must_beat else None)
+    else:
+      for trial in trials:
+        trial.animat.evaluate(Env(trial.seed), recording, must_beat.get(trial.i))
+    for trial in trials:
+      trial.fitnesses[trial.k] = trial.animat.fitness
+      # stopped runs are not cached, their partial fitnesses are only good for this tournament
+      if trial.animat.fidelity == self.horizons()[-1]:
+        self.cache.put(trial.key, trial.animat.fitness, trial.animat.rung_fitness)
+    for i, _, fitnesses in pending:
+      self.set_fitness(i, fitnesses)
+
+  def set_fitness(self, i, fitnesses):
+    # aggregate over the env seeds
+    animat = self.animats[i]
+    animat.fitnesses = fitnesses
+    animat.fitness = fitnesses[0] if len(fitnesses) == 1 else np.mean(fitnesses)
+    animat.fitness_var = np.var(fitnesses)
+    self.evaluated.add(i)
+
+  def horizons(self):
+    # lifetime in steps at each rung, doubling up to the full lifetime
+    n_steps = math.floor(Animat.MAX_LIFE / DT)
+    return [n_steps // 2**(Population.HALVING_RUNGS - 1 - rung) for rung in range(Population.HALVING_RUNGS - 1)] + [n_steps]
+
+  def race(self, animats, seed):
+    # successive halving, ranked by fitness among those still running at the end of each horizon
+    trial = BatchedTrial(animats, [Env(seed) for _ in animats])
+    running = np.ones(len(animats), dtype=bool)
+    for horizon in self.horizons():
+      trial.run(horizon)
+      fitness = trial.kinematics.fitness
+      for k in np.flatnonzero(running):
+        animats[k].rung_fitness[horizon] = fitness[k]
+      # the dead are complete, their fitness will not change
+      running &= trial.kinematics.alive
+      if horizon < trial.n_steps:
+        ranked = np.flatnonzero(running)[np.argsort(-fitness[running], kind='stable')]
+        running[ranked[math.ceil(len(ranked) * Population.HALVING_KEEP):]] = False
+        trial.stop(running)
+    trial.finish()
+
+  def beats(self, a, b):
+    a, b = self.animats[a], self.animats[b]
+    if not self.halving:
+      return a.fitness > b.fitness
+    # compare at the longest horizon both reached, a run that ended earlier keeps its final fitness
+    horizon = min(a.fidelity, b.fidelity)
+    return a.rung_fitness.get(horizon, a.fitness) > b.rung_fitness.get(horizon, b.fitness)
+
+  def eval(self, generation, batched=True, recording=Recording.NONE, seeds=None):
+    # fitness is the mean over the given env seeds, by default just the generation
+    seeds = (generation,) if seeds is None else tuple(seeds)
+    self.batched = batched
+    everyone = range(Population.SIZE)
+    if self.lazy and recording == Recording.NONE and self.generation % Population.STATS_INTERVAL:
+      # statistics from the coming tournaments and cached fitnesses, everyone is simulated every STATS_INTERVAL generations
+      self.evaluate(everyone, seeds, simulate=False)
+      if self.pruning:
+        self.evaluate_pairs(seeds, batched)
+      else:
+        self.evaluate(self.participants(), seeds, batched)
+    else:
+      self.evaluate(everyone, seeds, batched, recording)
+    # individuals stopped at an earlier horizon or once their tournament was settled only have a partial fitness
+    indices = [i for i in sorted(self.evaluated) if self.animats[i].fidelity == self.horizons()[-1]] or sorted(self.evaluated)
+    fitnesses = [self.animats[i].fitness for i in indices]
 
     best_index = np.argmax(fitnesses)
     max = fitnesses[best_index]
     mean = np.mean(fitnesses)
     min = np.amin(fitnesses)
     print('max:', round(max, 3), 'mean:', round(mean, 3), 'min:', round(min, 3))
-    return max, mean, min, self.animats[best_index]
+    return max, mean, min, self.animats[indices[best_index]]
+
+  def evaluate_pairs(self, seeds, batched=True):
+    # one member of each pair in full, then the other only until it surely beats or loses to it
+    pairs = self.draw_pairs()
+    counts = Counter(i for pair in pairs for i in pair)
+    first = [i for i in self.participants() if counts[i] > 1]
+    for a, b in pairs:
+      if counts[a] == 1 and counts[b] == 1 and a not in self.evaluated and b not in self.evaluated:
+        first.append(b)
+    self.evaluate(sorted(first), seeds, batched)
+    opponents = {i: j for a, b in pairs for i, j in ((a, b), (b, a))}
+    self.evaluate(self.participants(), seeds, batched, must_beat={i: self.animats[opponents[i]].fitness for i in self.participants()})
+
+  def draw_pairs(self):
+    # the pairs do not depend on fitness, so all are drawn before anyone is simulated
+    if self.pairs is None:
+      self.pairs = []
+      for _ in range(Population.N_TOUR_ROUNDS):
+        a = POP_RNG.integers(Population.SIZE)
+        b = (a + 1 + POP_RNG.integers(Population.DEME_SIZE)) % Population.SIZE # wrap around
+        self.pairs.append((a, b))
+    return self.pairs
+
+  def participants(self):
+    return sorted({i for pair in self.draw_pairs() for i in pair} - self.evaluated)
 
   def evolve(self):
-    controllers = [animat.controller.deep_copy() for animat in self.animats]
-    for _ in range(Population.N_TOUR_ROUNDS):
-      a = POP_RNG.integers(Population.SIZE)
-      b = (a + 1 + POP_RNG.integers(Population.DEME_SIZE)) % Population.SIZE # wrap around
+    if self.lazy and self.pruning:
+      self.evaluate_pairs(self.seeds, self.batched)
+    elif self.lazy:
+      self.evaluate(self.participants(), self.seeds, self.batched)
+    pairs = self.draw_pairs()
+    self.pairs = None
 
-      if (self.animats[a].fitness > self.animats[b].fitness):
+    # survivors keep their controller, only tournament losers get a fresh copy to mutate
+    controllers = [animat.controller for animat in self.animats]
+    for a, b in pairs:
+      if self.beats(a, b):
         controllers[b] = controllers[a].deep_copy()
         controllers[b].mutate()
       else:
@@ -49,6 +208,8 @@ class Population:
         controllers[a].mutate()
     
     self.animats = [Animat(controller) for controller in controllers]
+    self.evaluated = set()
+    self.generation += 1
   
 
 if __name__ == '__main__':
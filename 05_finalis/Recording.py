@@ -0,0 +1,7 @@
+from enum import IntEnum
+
+class Recording(IntEnum):
+
+  NONE = 0
+  SAMPLED = 1
+  FULL = 2
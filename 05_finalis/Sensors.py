@@ -0,0 +1,28 @@
+import numpy as np
+
+# larger falloff means farther sight
+FALLOFF = 0.25
+
+
+def get_sens_readings(x, y, theta, obj_x, obj_y, radius, sensor_angles):
+  # animats along the first axis, objects are the nearest of each type, readings are animat x side x type
+  sens_orient = theta[:, None] + np.asarray(sensor_angles)[None, :]
+  uv_x = np.cos(sens_orient)[:, :, None]
+  uv_y = np.sin(sens_orient)[:, :, None]
+  sens_x = x[:, None, None] + radius * uv_x
+  sens_y = y[:, None, None] + radius * uv_y
+
+  d_sq = (sens_x - obj_x[:, None, :])**2 + (sens_y - obj_y[:, None, :])**2
+
+  omni = FALLOFF/(FALLOFF + d_sq) # (0,1)
+
+  # sensor to object vector, normalised unless the sensor sits on the object
+  s2o_x = obj_x[:, None, :] - sens_x
+  s2o_y = obj_y[:, None, :] - sens_y
+  s2o_mag = np.sqrt(d_sq)
+  nonzero = s2o_mag > 0
+  s2o_x = np.divide(s2o_x, s2o_mag, out=s2o_x, where=nonzero)
+  s2o_y = np.divide(s2o_y, s2o_mag, out=s2o_y, where=nonzero)
+
+  # positive component of sensor to object projection on sensor direction
+  return omni * np.fmax(s2o_x*uv_x + s2o_y*uv_y, 0.0)
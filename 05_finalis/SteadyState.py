@@ -0,0 +1,114 @@
+import multiprocessing as mp, queue
+import numpy as np
+from Animat import Animat
+from Env import Env
+from Compiled import CompiledNetwork
+from Population import Population, POP_RNG
+
+
+def evaluate_array(task):
+  seed, array = task
+  animat = Animat(chemistry=CompiledNetwork.from_array(array))
+  animat.evaluate(Env(seed))
+  return animat.fitness
+
+
+class SteadyStateEngine:
+
+  MAX_DRAWS = 1000
+
+  def __init__(self, population, seed, processes=None):
+    # the deme ring, a fitness of None is not known yet
+    self.controllers = [animat.controller for animat in population.animats]
+    self.fitnesses = [None for _ in self.controllers]
+    self.cache = population.cache
+    self.seed = seed
+    self.processes = processes or mp.cpu_count()
+    self.pool = mp.Pool(self.processes)
+    self.results = queue.Queue()
+    # individuals in a running tournament, nobody else may draw them
+    self.busy = set()
+    self.n_tournaments = 0
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
+
+  def draw_pair(self):
+    for _ in range(SteadyStateEngine.MAX_DRAWS):
+      a = POP_RNG.integers(Population.SIZE)
+      b = (a + 1 + POP_RNG.integers(Population.DEME_SIZE)) % Population.SIZE # wrap around
+      if a not in self.busy and b not in self.busy:
+        return a, b
+    return None
+
+  def submit(self, i):
+    # cached fitnesses are used straight away, anything else goes to a free worker
+    key = self.cache.key(self.controllers[i], self.seed)
+    entry = self.cache.get(key)
+    if entry is not None:
+      self.fitnesses[i], _ = entry
+      return
+    task = (self.seed, self.controllers[i].compile().to_array())
+    self.pool.apply_async(evaluate_array, (task,), callback=lambda fitness: self.results.put((i, key, fitness, None)),
+                          error_callback=lambda error: self.results.put((i, key, None, error)))
+
+  def finish(self, a, b):
+    if self.fitnesses[a] > self.fitnesses[b]:
+      winner, loser = a, b
+    else:
+      winner, loser = b, a
+    # the mutated clone replaces the loser straight away
+    self.controllers[loser] = self.controllers[winner].deep_copy()
+    self.controllers[loser].mutate()
+    self.fitnesses[loser] = None
+    self.busy -= {a, b}
+    self.n_tournaments += 1
+    if self.n_tournaments % Population.SIZE == 0:
+      self.print_stats()
+
+  def run(self, n_tournaments):
+    # no generation barrier, a new tournament starts whenever one finishes
+    running = []
+    started = 0
+    while started < n_tournaments or running:
+      while started < n_tournaments and len(running) < self.processes:
+        pair = self.draw_pair()
+        if pair is None:
+          break
+        self.busy.update(pair)
+        for i in set(pair):
+          if self.fitnesses[i] is None:
+            self.submit(i)
+        running.append(pair)
+        started += 1
+
+      ready = [pair for pair in running if None not in (self.fitnesses[pair[0]], self.fitnesses[pair[1]])]
+      if not ready:
+        i, key, fitness, error = self.results.get()
+        if error is not None:
+          raise error
+        self.cache.put(key, fitness)
+        self.fitnesses[i] = fitness
+        continue
+      for pair in ready:
+        running.remove(pair)
+        self.finish(*pair)
+
+  def print_stats(self):
+    fitnesses = [fitness for fitness in self.fitnesses if fitness is not None]
+    if fitnesses:
+      print('tournaments:', self.n_tournaments, 'max:', round(np.amax(fitnesses), 3), 'mean:', round(np.mean(fitnesses), 3), 'min:', round(np.amin(fitnesses), 3))
+
+  def write_back(self, population):
+    population.animats = [Animat(controller) for controller in self.controllers]
+    for animat, fitness in zip(population.animats, self.fitnesses):
+      animat.fitness = 0 if fitness is None else fitness
+
+
+if __name__ == '__main__':
+  pop = Population()
+  engine = SteadyStateEngine(pop, seed=0)
+  engine.run(Population.SIZE * Population.N_TOUR_ROUNDS)
+  engine.close()
+  engine.write_back(pop)
@@ -2,40 +2,48 @@ import numpy as np, matplotlib.pyplot as plt
 from Env import Env
 from Population import Population
 from Animat import test_animat_trial
+from Recording import Recording
 
 if __name__ == '__main__':
 
   BATCHES = 1
   BATCH_SIZE = 400
+  # worker processes to simulate on, e.g. os.cpu_count(), None simulates in this process
+  PROCESSES = None
 
   highest_fitness = 0
-  pop = Population()
+  pop = Population(processes=PROCESSES)
   mean = [None] * BATCHES * BATCH_SIZE
   max = [None] * BATCHES * BATCH_SIZE
   min = [None] * BATCHES * BATCH_SIZE
   
-  for batch in range(BATCHES):
-    highest_fitness = 0
-    fig2, axs2 = plt.subplots(figsize=(8,8))
-
-    for repeat in range(BATCH_SIZE):
-      gen = batch * BATCH_SIZE + repeat
-      print(gen)
-      max[gen], mean[gen], min[gen], best = pop.eval(batch)
-      if best.fitness > highest_fitness + 0.0001:
-        highest_fitness = best.fitness
-        plt.close('all')
-        test_animat_trial(env=Env(batch), controller=best.controller.deep_copy(), show=False, save=True, fname=batch)
-      pop.evolve()
-
-    pop.eval(batch)
-    axs2.set_title('Population trajectories')
-    axs2.set_aspect('equal')
-    axs2.set_xlim(Env.MIN_X, Env.MAX_X)
-    axs2.set_ylim(Env.MIN_Y, Env.MAX_Y)
-    for animat in pop.animats:
-      axs2.plot(animat.x_hist, animat.y_hist, 'k-', ms=1, alpha=0.1)
-    fig2.savefig(f'plot-population_{batch}')
+  try:
+    for batch in range(BATCHES):
+      highest_fitness = 0
+      fig2, axs2 = plt.subplots(figsize=(8,8))
+
+      for repeat in range(BATCH_SIZE):
+        gen = batch * BATCH_SIZE + repeat
+        print(gen)
+        max[gen], mean[gen], min[gen], best = pop.eval(batch)
+        if best.fitness > highest_fitness + 0.0001:
+          highest_fitness = best.fitness
+          plt.close('all')
+          test_animat_trial(env=Env(batch), controller=best.controller.deep_copy(), show=False, save=True, fname=batch)
+        pop.evolve()
+
+      pop.eval(batch, recording=Recording.FULL)
+      axs2.set_title('Population trajectories')
+      axs2.set_aspect('equal')
+      axs2.set_xlim(Env.MIN_X, Env.MAX_X)
+      axs2.set_ylim(Env.MIN_Y, Env.MAX_Y)
+      for animat in pop.animats:
+        axs2.plot(animat.x_hist, animat.y_hist, 'k-', ms=1, alpha=0.1)
+      fig2.savefig(f'plot-population_{batch}')
+  finally:
+    # the pool's workers would otherwise outlive the run
+    if pop.evaluator is not None:
+      pop.evaluator.close()
 
 
   fig1, axs1 = plt.subplots(figsize=(16,8))
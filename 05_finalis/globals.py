@@ -4,4 +4,6 @@ AGGREGATION = True
 
 MUTATION_RATE = 0.1
 
-DRAIN_RATE = -1
\ No newline at end of file
+DRAIN_RATE = -1
+
+RECORD_INTERVAL = 10
\ No newline at end of file